@@ -4,27 +4,51 @@ import websockets
 import json
 import os
 import re
+import time
+import itertools
+import io
+import wave
 import base64
-import requests
+import copy
+import logging
+import signal
+import sys
 import dashscope
+import openai
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 
-from openai import OpenAI
+from api_clients import CircuitBreaker, CircuitOpenError, call_with_retries_async, create_download_session, create_llm_client
+from ingest_queue import IngestQueue, DROP_LOWEST
+from response_cache import ResponseCache, SqliteResponseCache
+from tts_cache import TTSAudioCache, tts_cache_key
+from audio_codec import AUDIO_MIME_TYPES, available_formats, choose_format, encode_audio
+from client_session import ClientSession, DROP_OLDEST as CLIENT_DROP_OLDEST, frames_size
+from reply_scheduler import ReplyScheduler
+from conversation_memory import ConversationMemory, estimate_tokens
+from config_store import DEFAULT_CONFIG, DEFAULT_PERSONA_PROMPT, ConfigSnapshot, apply_config_patch, file_signature, read_config_file, write_config_file
+from room import DEFAULT_ROOM_ID, Room, room_id_from_path, valid_room_id
+from room_router import proxy_connection
+from metrics import MetricsRegistry, start_metrics_server
+from logging_setup import configure_logging
+
+logger = logging.getLogger("ai_backend")
 
 # Try to import local API configuration
 try:
     import api_config
 except ImportError:
     api_config = None
-    print("[Backend] api_config.py not found. Will try to load API keys from environment variables or prompt for input.")
+    logger.warning("api_config.py not found. Will try to load API keys from environment variables or prompt for input.")
 
 # --- AI Configuration ---
-# BASE_URL is for DeepSeek API
-BASE_URL = "https://api.deepseek.com/v1"
+# BASE_URL is for DeepSeek API (override with DEEPSEEK_BASE_URL, e.g. to point at a local stub server)
+BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
 MODEL = "deepseek-chat"
 
 # --- DashScope TTS Configuration ---
 DASHSCOPE_API_KEY = None
+DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/api/v1") # Assuming China region
 QWEN_TTS_MODEL_NAME = "qwen3-tts-flash" # Use the recommended flash model
 QWEN_TTS_VOICE_NAME = "Cherry" # Default voice, can be changed. Examples: "Cherry", "Ryan", "Tina", "Xiaoice"
 QWEN_TTS_LANGUAGE = "Chinese" # Default language, "Chinese", "English"
@@ -32,237 +56,1040 @@ QWEN_TTS_LANGUAGE = "Chinese" # Default language, "Chinese", "English"
 # Global variable for DeepSeek API key
 DEEPSEEK_API_KEY = None
 
-keywords_config = {}
-ai_settings = {} # Global for AI specific settings (from current persona)
-full_config = {} # Global to store the entire loaded config for frontend management (including all personas)
+# --- Pipeline Concurrency Configuration ---
+LLM_MAX_CONCURRENCY = 4 # Max in-flight DeepSeek requests
+TTS_MAX_CONCURRENCY = 2 # Max in-flight DashScope synthesis + download jobs
+TTS_EXECUTOR_WORKERS = 4 # Threads for the blocking DashScope SDK / audio download calls
+
+LLM_SEMAPHORE = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+TTS_SEMAPHORE = asyncio.Semaphore(TTS_MAX_CONCURRENCY)
+TTS_EXECUTOR = ThreadPoolExecutor(max_workers=TTS_EXECUTOR_WORKERS, thread_name_prefix="tts")
+
+# --- Logging & Metrics Configuration ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO") # DEBUG additionally logs full prompts and every queued frame
+LOG_FORMAT = os.getenv("LOG_FORMAT", "logfmt") # logfmt or json
+LOG_RATE_LIMIT_BURST = 20 # Per log call site: at most this many records per interval; the rest are counted, not printed
+LOG_RATE_LIMIT_INTERVAL_SECONDS = 60
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108")) # Prometheus endpoint at http://127.0.0.1:9108/metrics (0 disables)
+
+METRICS = MetricsRegistry("danmaku")
+STAGE_SECONDS = METRICS.histogram("stage_duration_seconds", "Time spent in each pipeline stage.", ("stage",))
+TIME_TO_FIRST_AUDIO_SECONDS = METRICS.histogram("time_to_first_audio_seconds", "From comment received to the first reply audio handed to clients.", ("mode",))
+MESSAGES = METRICS.counter("messages", "Chat comments by triage outcome.", ("outcome",))
+UPSTREAM_REQUESTS = METRICS.counter("upstream_requests", "DeepSeek / DashScope calls by outcome.", ("upstream", "outcome"))
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+LLM_PROMPT_TOKENS = METRICS.histogram("llm_prompt_tokens", "Estimated prompt tokens per LLM request, by part (system, history, question, total).", ("part",), TOKEN_BUCKETS)
+LLM_TOKENS = METRICS.counter("llm_tokens", "Tokens DeepSeek reports as used, by kind (prompt, prompt_cache_hit, completion).", ("kind",))
+
+# --- Upstream API Client Configuration ---
+API_CONNECT_TIMEOUT_SECONDS = 5
+LLM_READ_TIMEOUT_SECONDS = 20
+TTS_REQUEST_TIMEOUT_SECONDS = 30
+AUDIO_DOWNLOAD_TIMEOUT_SECONDS = 20
+API_RETRY_ATTEMPTS = 3 # Total attempts per call, with full-jitter exponential backoff in between
+API_RETRY_BASE_DELAY_SECONDS = 0.3
+API_RETRY_MAX_DELAY_SECONDS = 3
+CIRCUIT_FAILURE_THRESHOLD = 5 # Consecutive failures before an upstream is considered degraded
+CIRCUIT_RESET_SECONDS = 30 # How long a degraded upstream is skipped before a trial request
+
+LLM_BREAKER = CircuitBreaker("DeepSeek", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+TTS_BREAKER = CircuitBreaker("DashScope TTS", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+LLM_CLIENT = None # Shared AsyncOpenAI client, created on first use (see get_llm_client)
+DOWNLOAD_SESSION = create_download_session(TTS_EXECUTOR_WORKERS) # Shared keep-alive pool for audio downloads
+
+def get_llm_client():
+    global LLM_CLIENT
+    if LLM_CLIENT is None:
+        LLM_CLIENT = create_llm_client(DEEPSEEK_API_KEY, BASE_URL, API_CONNECT_TIMEOUT_SECONDS, LLM_READ_TIMEOUT_SECONDS, LLM_MAX_CONCURRENCY)
+    return LLM_CLIENT
+
+# --- Worker Process Configuration ---
+# >0: this process only accepts connections and routes each room to one of this many worker processes
+# (crc32(room_id) % N), which serve on the following ports and share the response cache via SQLite.
+WORKER_PROCESSES = int(os.getenv("AI_BACKEND_WORKERS", "0"))
+WORKER_INDEX = os.getenv("AI_BACKEND_WORKER_INDEX") # Set by the front process in each worker
+WORKER_COUNT = int(os.getenv("AI_BACKEND_WORKER_COUNT", "1")) # Workers splitting the global limits below (1 outside worker mode)
+WORKER_RESTART_DELAY_SECONDS = 1
+
+def worker_share(limit: int) -> int:
+    """This process's part of a limit that holds for the whole backend; each worker enforces only its own."""
+    return max(1, -(-limit // WORKER_COUNT)) if limit else limit
+
+# --- Ingest Queue Configuration ---
+INGEST_QUEUE_CAPACITY = 200 # Max comments waiting for a reply; beyond this, items are shed
+INGEST_DROP_POLICY = DROP_LOWEST # DROP_LOWEST (keyword/product questions survive) or DROP_OLDEST
+INGEST_MAX_AGE_SECONDS = 30 # Comments waiting longer than this are discarded instead of answered
+INGEST_WORKERS = LLM_MAX_CONCURRENCY # Worker tasks draining the queue into the LLM/TTS stages
+
+# Ingest priorities: higher is answered first and shed last
+PRIORITY_FREE_CHAT = 0
+PRIORITY_KEYWORD = 1
+PRIORITY_PRODUCT = 2
+
+def release_discarded_job(job: dict):
+    """A queued comment was shed or went stale unanswered: its viewer and question may be answered again."""
+    REPLY_SCHEDULER.release(job["user_key"], job["content"], scope=job["room_id"])
+
+INGEST_QUEUE = IngestQueue(INGEST_QUEUE_CAPACITY, INGEST_DROP_POLICY, INGEST_MAX_AGE_SECONDS, on_discard=release_discarded_job)
+INGEST_WORKER_TASKS = []
+
+# --- Reply Scheduling Configuration ---
+REPLY_BUDGET_PER_MINUTE = 20 # Max LLM replies per sliding minute over all workers (0 = unlimited); the rest wait in the ingest queue
+REPLY_USER_COOLDOWN_SECONDS = 20 # One answered comment per viewer in this window
+REPLY_DEDUP_WINDOW_SECONDS = 60 # Near-identical questions within this window are answered once
+REPLY_BATCHING_ENABLED = False # Merge several pending questions into one LLM request and one combined answer
+REPLY_BATCH_MAX_SIZE = 4
+REPLY_BATCH_WINDOW_SECONDS = 1.5 # How long a worker waits for more questions to join a batch
+
+REPLY_SCHEDULER = ReplyScheduler(worker_share(REPLY_BUDGET_PER_MINUTE), REPLY_USER_COOLDOWN_SECONDS, REPLY_DEDUP_WINDOW_SECONDS)
+
+# --- Response Cache Configuration ---
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_MAX_ENTRIES = 512 # LRU-evicted beyond this
+RESPONSE_CACHE_TTL_SECONDS = 600 # Cached replies older than this are regenerated
+RESPONSE_CACHE_NEAR_DUPLICATE = False # Also ignore punctuation, emoji and repeated characters when matching
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "0") == "1" # Keep replies in SQLite so worker processes share them
+RESPONSE_CACHE_DB = "response_cache.sqlite3"
+
+if RESPONSE_CACHE_SHARED:
+    RESPONSE_CACHE = SqliteResponseCache(RESPONSE_CACHE_DB, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_NEAR_DUPLICATE)
+else:
+    RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_NEAR_DUPLICATE)
+
+# --- Conversation Memory Configuration ---
+# Recent question/answer turns per viewer (per room), sent along with that viewer's next question
+CONVERSATION_MEMORY_ENABLED = True
+CONVERSATION_MEMORY_MAX_TURNS = 3 # Ring buffer size per viewer
+CONVERSATION_MEMORY_MAX_TOKENS = 200 # History sent with one request is trimmed, oldest turn first, to about this many tokens
+CONVERSATION_MEMORY_MAX_USERS = 5000 # Least recently active viewers are forgotten beyond this
+CONVERSATION_MEMORY_IDLE_SECONDS = 600 # ...and viewers who haven't been answered for this long
+CONVERSATION_MEMORY_MAX_CHARS = 2_000_000 # Cap on stored text over all viewers
+
+CONVERSATION_MEMORY = ConversationMemory(
+    CONVERSATION_MEMORY_MAX_TURNS, CONVERSATION_MEMORY_MAX_TOKENS, CONVERSATION_MEMORY_MAX_USERS,
+    CONVERSATION_MEMORY_IDLE_SECONDS, CONVERSATION_MEMORY_MAX_CHARS,
+)
+
+# --- TTS Audio Cache Configuration ---
+TTS_CACHE_ENABLED = True
+TTS_CACHE_DIR = "tts_cache"
+TTS_CACHE_MAX_BYTES = 256 * 1024 * 1024 # LRU-evicted beyond this; workers share the directory and split the cap
+TTS_CACHE_PREWARM = True # Synthesize every keyword's response_template in the background at startup and after config changes
+
+TTS_CACHE = TTSAudioCache(TTS_CACHE_DIR, worker_share(TTS_CACHE_MAX_BYTES)) if TTS_CACHE_ENABLED else None
+
+# Strong references to fire-and-forget background tasks (e.g. cache pre-warming)
+BACKGROUND_TASKS = set()
+
+# --- Config Reload Configuration ---
+KEYWORD_CONFIG_FILE = "keywords_config.json" # The default room's config, also used by rooms without their own file
+CONFIG_WATCH_INTERVAL_SECONDS = 1.0 # Poll config files for outside edits this often (0 disables watching)
+
+# --- Room Configuration ---
+# Each relay connection declares a room (`?room=<id>` or the `join_room` action) and gets that room's
+# persona, keywords and reply broadcasts. Rooms are created on first use; each holds its own live
+# ConfigSnapshot (see room.Room). The ingest queue, reply budget and caches are shared by all rooms
+# (of this process: in worker mode each worker has its own queue and a share of the budget).
+ROOM_CONFIG_DIR = "rooms" # rooms/<room_id>.json; written on the first save or patch for that room
+MAX_ROOMS = 100 # Rooms held at once; joining a new room beyond this is refused
+ROOM_IDLE_SECONDS = 300 # Rooms (except the default one) without clients for this long are dropped
+ROOMS = {} # room_id -> Room
+
+# --- Keyword Matching Configuration ---
+KEYWORD_MATCH_LONGEST_ONLY = False # Ignore a keyword when it only occurs inside a longer matched keyword
+KEYWORD_MATCH_SUPPRESS_OVERLAPS = False # Keep only non-overlapping (leftmost-longest) keyword hits
 
-async def get_ai_response(user_message: str, system_message: str): # system_message no longer has a default here
+# --- Streaming Configuration ---
+STREAMING_MODE = False # Stream LLM tokens and synthesize/broadcast each sentence as an `ai_response_chunk`
+STREAM_SENTENCE_ENDINGS = "。！？!?；;…~\n"
+STREAM_MIN_CHUNK_CHARS = 6 # Don't cut a chunk shorter than this; very short clips sound choppy
+STREAM_IDS = itertools.count(1)
+
+MOOD_INSTRUCTION = "在回答的开头，请务必根据你的回复内容和情绪，在以下标签中选择最合适的一个，并将其作为前缀：[happy], [neutral], [selling], [confused], [thinking]。例如：[happy]你好呀！很高兴为你服务。"
+MOOD_PREFIX_RE = re.compile(r"\[(\w+)\]")
+MOOD_PREFIX_MAX_CHARS = 16 # A reply that hasn't closed its [mood] tag by now doesn't have one
+
+def parse_mood_prefix(ai_response_text: str):
+    """Splits a leading `[mood]` tag off the reply. Returns (message, mood)."""
+    match = MOOD_PREFIX_RE.match(ai_response_text)
+    if match:
+        return ai_response_text[len(match.group(0)):].strip(), match.group(1)
+    return ai_response_text.strip(), "neutral"
+
+def build_llm_messages(user_message: str, system_message: str, history=()):
+    """
+    Chat messages for one request: system prompt, earlier turns with this viewer (oldest first,
+    answers with their [mood] tag so the format carries on), then the new question.
+    """
+    full_system_prompt = f"{system_message}\n\n{MOOD_INSTRUCTION}"
+    messages = [{"role": "system", "content": full_system_prompt}]
+    for question, answer in history:
+        messages.append({"role": "user", "content": question})
+        messages.append({"role": "assistant", "content": answer})
+    messages.append({"role": "user", "content": user_message})
+
+    system_tokens = estimate_tokens(full_system_prompt)
+    history_tokens = sum(estimate_tokens(q) + estimate_tokens(a) for q, a in history)
+    question_tokens = estimate_tokens(user_message)
+    LLM_PROMPT_TOKENS.labels("system").observe(system_tokens)
+    LLM_PROMPT_TOKENS.labels("history").observe(history_tokens)
+    LLM_PROMPT_TOKENS.labels("question").observe(question_tokens)
+    LLM_PROMPT_TOKENS.labels("total").observe(system_tokens + history_tokens + question_tokens)
+    logger.debug("-> Sending to AI: %r with system prompt: %r and %d earlier turn(s)", user_message, full_system_prompt, len(history))
+    return messages
+
+def record_llm_usage(usage):
+    """Counts the tokens DeepSeek billed for one request (`usage` may be missing, e.g. from proxies)."""
+    if usage is None: return
+    LLM_TOKENS.labels("prompt").inc(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels("completion").inc(usage.completion_tokens or 0)
+    cache_hit_tokens = getattr(usage, "prompt_cache_hit_tokens", None) # DeepSeek extension: prompt prefix served from its context cache
+    if cache_hit_tokens:
+        LLM_TOKENS.labels("prompt_cache_hit").inc(cache_hit_tokens)
+
+async def get_ai_response(user_message: str, system_message: str, history=()): # system_message no longer has a default here
     """
     Calls the DeepSeek API to get an AI response.
+    `history` holds earlier (question, answer) turns with the same viewer.
     Returns a tuple of (message, mood).
     """
     if not DEEPSEEK_API_KEY:
-        print("!!! DeepSeek API Key is not set. Cannot call AI API.")
+        logger.error("DeepSeek API Key is not set. Cannot call AI API.")
         return None, None
 
-    mood_instruction = "在回答的开头，请务必根据你的回复内容和情绪，在以下标签中选择最合适的一个，并将其作为前缀：[happy], [neutral], [selling], [confused], [thinking]。例如：[happy]你好呀！很高兴为你服务。"
-    full_system_prompt = f"{system_message}\n\n{mood_instruction}"
+    messages = build_llm_messages(user_message, system_message, history)
+
+    async def request():
+        # The semaphore is taken per attempt, so backoff sleeps don't hold an LLM slot
+        async with LLM_SEMAPHORE:
+            return await get_llm_client().chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=100
+            )
 
-    print(f"-> Sending to AI: '{user_message}' with system prompt: '{full_system_prompt}'")
     try:
-        client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=BASE_URL)
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": full_system_prompt},
-                {"role": "user", "content": user_message},
-            ],
-            temperature=0.7,
-            max_tokens=100
-        )
+        with STAGE_SECONDS.labels("llm").time():
+            response = await call_with_retries_async(
+                request, LLM_BREAKER, API_RETRY_ATTEMPTS, API_RETRY_BASE_DELAY_SECONDS, API_RETRY_MAX_DELAY_SECONDS, is_retryable_llm_error,
+            )
+        record_llm_usage(response.usage)
         ai_response_text = response.choices[0].message.content
-        
-        mood = "neutral"
-        match = re.match(r"\[(\w+)\]", ai_response_text)
-        if match:
-            mood = match.group(1)
-            ai_message = ai_response_text[len(match.group(0)):].strip()
-        else:
-            ai_message = ai_response_text.strip()
-            
-        print(f"<- AI Response (Mood: {mood}): {ai_message}")
+        ai_message, mood = parse_mood_prefix(ai_response_text)
+
+        UPSTREAM_REQUESTS.labels("llm", "ok").inc()
+        logger.info("<- AI Response (Mood: %s): %s", mood, ai_message)
         return ai_message, mood
         
+    except CircuitOpenError:
+        UPSTREAM_REQUESTS.labels("llm", "circuit_open").inc()
+        logger.warning("DeepSeek circuit open, skipping AI call.")
+        return None, None
     except Exception as e:
-        print(f"!!! Error calling AI API: {e}")
+        UPSTREAM_REQUESTS.labels("llm", "error").inc()
+        logger.error("Error calling AI API: %s", e)
         return None, None
 
 
-def synthesize_dashscope_tts(text: str):
+async def stream_ai_response(user_message: str, system_message: str, history=()):
     """
-    Synthesizes speech from text using Aliyun DashScope Qwen-TTS API.
-    Downloads the audio from the provided URL in the response.
-    Returns a tuple of (WAV audio bytes, sampling rate).
+    Streaming variant of `get_ai_response`: an async generator of raw text deltas
+    (the `[mood]` prefix is left in for the caller to parse).
     """
-    if not DASHSCOPE_API_KEY:
-        print("!!! DashScope API Key is not set. Cannot synthesize speech.")
-        return None, None
-    
-    dashscope.api_key = DASHSCOPE_API_KEY
-    dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1'
+    if not DEEPSEEK_API_KEY:
+        logger.error("DeepSeek API Key is not set. Cannot call AI API.")
+        return
+
+    messages = build_llm_messages(user_message, system_message, history)
+    started = time.perf_counter()
+
+    async def open_stream():
+        # Like get_ai_response, the semaphore is taken per attempt so backoff sleeps don't hold an
+        # LLM slot; once a stream is open its slot stays taken until the stream has been read
+        await LLM_SEMAPHORE.acquire()
+        try:
+            return await get_llm_client().chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=100,
+                stream=True,
+                stream_options={"include_usage": True} # Usage arrives in a last chunk without choices
+            )
+        except BaseException:
+            LLM_SEMAPHORE.release()
+            raise
 
-    print(f"[DashScope TTS] Synthesizing speech for: '{text}' (Voice: {QWEN_TTS_VOICE_NAME}, Lang: {QWEN_TTS_LANGUAGE})")
+    # Only opening the stream is retried; once tokens have been spoken a retry would repeat them
+    stream = await call_with_retries_async(
+        open_stream, LLM_BREAKER, API_RETRY_ATTEMPTS, API_RETRY_BASE_DELAY_SECONDS, API_RETRY_MAX_DELAY_SECONDS, is_retryable_llm_error,
+    )
     try:
+        first_token = True
+        try:
+            async for event in stream:
+                if event.usage is not None:
+                    record_llm_usage(event.usage)
+                if event.choices and event.choices[0].delta.content:
+                    if first_token:
+                        STAGE_SECONDS.labels("llm_first_token").observe(time.perf_counter() - started)
+                        first_token = False
+                    yield event.choices[0].delta.content
+        except Exception:
+            LLM_BREAKER.record_failure()
+            UPSTREAM_REQUESTS.labels("llm", "error").inc()
+            raise
+        STAGE_SECONDS.labels("llm").observe(time.perf_counter() - started)
+        UPSTREAM_REQUESTS.labels("llm", "ok").inc()
+    finally:
+        LLM_SEMAPHORE.release()
+
+
+def split_sentences(buffer: str, final: bool = False):
+    """
+    Cuts complete sentences off the front of `buffer`.
+    Returns (chunks, remainder); with `final=True` the remainder is flushed as a last chunk.
+    """
+    chunks, start = [], 0
+    for i, ch in enumerate(buffer):
+        if ch in STREAM_SENTENCE_ENDINGS and i + 1 - start >= STREAM_MIN_CHUNK_CHARS:
+            # Keep runs of punctuation ("？！", "……") attached to their sentence
+            if i + 1 < len(buffer) and buffer[i + 1] in STREAM_SENTENCE_ENDINGS: continue
+            chunk = buffer[start:i + 1].strip()
+            if chunk: chunks.append(chunk)
+            start = i + 1
+    remainder = buffer[start:]
+    if final:
+        if remainder.strip(): chunks.append(remainder.strip())
+        remainder = ""
+    return chunks, remainder
+
+
+class TTSUpstreamError(Exception):
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+def is_retryable_status(status_code) -> bool:
+    return status_code == HTTPStatus.TOO_MANY_REQUESTS or (isinstance(status_code, int) and status_code >= 500)
+
+def is_retryable_tts_error(error: Exception) -> bool:
+    # Network errors / timeouts from the SDK or the download are retried; explicit 4xx answers are not
+    return error.retryable if isinstance(error, TTSUpstreamError) else True
+
+def is_retryable_llm_error(error: Exception) -> bool:
+    if isinstance(error, openai.APIStatusError):
+        return is_retryable_status(error.status_code)
+    return True
+
+def request_tts_audio(text: str):
+    """One synthesis + download attempt. Raises TTSUpstreamError on failure."""
+    with STAGE_SECONDS.labels("tts_synthesis").time():
         response = dashscope.MultiModalConversation.call(
             model=QWEN_TTS_MODEL_NAME,
             text=text,
             voice=QWEN_TTS_VOICE_NAME,
             language_type=QWEN_TTS_LANGUAGE,
+            request_timeout=TTS_REQUEST_TIMEOUT_SECONDS,
         )
+    if response.status_code != HTTPStatus.OK:
+        raise TTSUpstreamError(f"API call failed, status: {response.status_code}, message: {response.message}", is_retryable_status(response.status_code))
+    if not (hasattr(response.output, 'audio') and hasattr(response.output.audio, 'url') and response.output.audio.url):
+        raise TTSUpstreamError(f"API call successful, but no audio URL found in response: {response.output}", False)
 
-        if response.status_code == HTTPStatus.OK:
-            if hasattr(response.output, 'audio') and hasattr(response.output.audio, 'url') and response.output.audio.url:
-                audio_url = response.output.audio.url
-                print(f"[DashScope TTS] Audio URL received: {audio_url}")
-                
-                audio_download_response = requests.get(audio_url, stream=True)
-                if audio_download_response.status_code == HTTPStatus.OK:
-                    wav_bytes = audio_download_response.content
-                    
-                    sampling_rate = 16000 
-                    try:
-                        import wave
-                        import io
-                        with wave.open(io.BytesIO(wav_bytes), 'rb') as wf:
-                            sampling_rate = wf.getframerate()
-                    except Exception as e:
-                        print(f"[DashScope TTS] Could not read sampling rate from WAV header, using default 16000Hz: {e}")
-
-                    print(f"[DashScope TTS] Speech synthesized and downloaded successfully. (Sampling Rate: {sampling_rate})")
-                    return wav_bytes, sampling_rate
-                else:
-                    print(f"[DashScope TTS] Failed to download audio from URL. Status: {audio_download_response.status_code}")
-                    return None, None
-            else:
-                print(f"[DashScope TTS] API call successful, but no audio URL found in response: {response.output}")
-                return None, None
-        else:
-            print(f"[DashScope TTS] API call failed, status: {response.status_code}, message: {response.message}")
-            return None, None
+    audio_url = response.output.audio.url
+    logger.debug("[DashScope TTS] Audio URL received: %s", audio_url)
+    with STAGE_SECONDS.labels("audio_download").time():
+        audio_download_response = DOWNLOAD_SESSION.get(audio_url, timeout=(API_CONNECT_TIMEOUT_SECONDS, AUDIO_DOWNLOAD_TIMEOUT_SECONDS))
+    if audio_download_response.status_code != HTTPStatus.OK:
+        raise TTSUpstreamError(f"Failed to download audio from URL. Status: {audio_download_response.status_code}", is_retryable_status(audio_download_response.status_code))
+    return audio_download_response.content
 
-    except Exception as e:
-        print(f"[DashScope TTS] Error during speech synthesis: {e}")
+async def synthesize_dashscope_tts(text: str):
+    """
+    Synthesizes speech from text using Aliyun DashScope Qwen-TTS API.
+    Downloads the audio from the provided URL in the response.
+    Each attempt runs the blocking SDK call and download on the bounded TTS executor, holding a
+    TTS_SEMAPHORE slot; transient failures are retried with jittered backoff, slept without a slot.
+    While the DashScope circuit is open this returns immediately.
+    Returns a tuple of (WAV audio bytes, sampling rate).
+    """
+    if not DASHSCOPE_API_KEY:
+        logger.error("DashScope API Key is not set. Cannot synthesize speech.")
         return None, None
 
+    logger.info("[DashScope TTS] Synthesizing speech for: %r (Voice: %s, Lang: %s)", text, QWEN_TTS_VOICE_NAME, QWEN_TTS_LANGUAGE)
+    loop = asyncio.get_running_loop()
 
-KEYWORD_CONFIG_FILE = "keywords_config.json"
+    async def request():
+        async with TTS_SEMAPHORE:
+            return await loop.run_in_executor(TTS_EXECUTOR, request_tts_audio, text)
 
-def load_keywords_config():
-    global keywords_config, ai_settings, full_config
     try:
-        with open(KEYWORD_CONFIG_FILE, 'r', encoding='utf-8') as f:
-            full_config = json.load(f)
-            
-            # Extract keywords (all top-level keys except 'ai_settings')
-            keywords_config = {k: v for k, v in full_config.items() if k != "ai_settings"}
-            
-            # Extract AI settings and active persona settings
-            global_ai_settings = full_config.get("ai_settings", {})
-            current_persona_id = global_ai_settings.get("current_persona", "default_persona")
-            personas = global_ai_settings.get("personas", {})
-            
-            # Fallback to a default persona if current_persona_id is not found
-            active_persona = personas.get(current_persona_id, {
-                "name": "默认助手",
-                "response_mode": "keyword",
-                "persona_prompt": "你是一个直播间助手，你的名字叫“弹幕鸭”。请用友好、简洁、幽默的风格回答问题。",
-                "filtering_enabled": False,
-                "min_message_length": 1,
-                "meaningless_patterns": []
-            })
-            
-            # Populate ai_settings with the active persona's settings
-            ai_settings["current_persona_id"] = current_persona_id
-            ai_settings["current_persona_name"] = active_persona.get("name", "未知助手")
-            ai_settings["response_mode"] = active_persona.get("response_mode", "keyword")
-            ai_settings["persona_prompt"] = active_persona.get("persona_prompt", "你是一个直播间助手，你的名字叫“弹幕鸭”。请用友好、简洁、幽默的风格回答问题。")
-            ai_settings["filtering_enabled"] = active_persona.get("filtering_enabled", False)
-            ai_settings["min_message_length"] = active_persona.get("min_message_length", 1)
-            ai_settings["meaningless_patterns"] = active_persona.get("meaningless_patterns", [])
-            ai_settings["all_personas"] = personas # Keep all personas for frontend config
-
-        print(f"[Backend] Loaded keyword configurations from {KEYWORD_CONFIG_FILE}.")
-        print(f"[Backend] Active Persona: {ai_settings.get('current_persona_name')}")
-    except FileNotFoundError:
-        print(f"[Backend] !!! Error: {KEYWORD_CONFIG_FILE} not found. Initializing with default config.")
-        full_config = {
-            "ai_settings": {
-                "current_persona": "live_selling_assistant",
-                "personas": {
-                    "live_selling_assistant": {
-                        "name": "卖货助手",
-                        "response_mode": "keyword",
-                        "persona_prompt": "你是一个专业的直播带货助手，名字叫弹幕鸭。你的任务是积极、热情地回答用户关于商品的所有问题，引导他们下单，并主动介绍商品亮点和优惠活动。你的语气要充满活力和说服力。",
-                        "filtering_enabled": True,
-                        "min_message_length": 4,
-                        "meaningless_patterns": []
-                    }
-                }
-            }
-        }
-        # Recurse to load the default config properly
-        save_keywords_config(full_config)
-        load_keywords_config() 
-    except json.JSONDecodeError:
-        print(f"[Backend] !!! Error: Could not decode {KEYWORD_CONFIG_FILE}. Check JSON format.")
+        with STAGE_SECONDS.labels("tts").time():
+            wav_bytes = await call_with_retries_async(
+                request, TTS_BREAKER,
+                API_RETRY_ATTEMPTS, API_RETRY_BASE_DELAY_SECONDS, API_RETRY_MAX_DELAY_SECONDS, is_retryable_tts_error,
+            )
+    except CircuitOpenError:
+        UPSTREAM_REQUESTS.labels("tts", "circuit_open").inc()
+        logger.warning("[DashScope TTS] Circuit open, skipping speech synthesis.")
+        return None, None
     except Exception as e:
-        print(f"[Backend] !!! An unexpected error occurred while loading {KEYWORD_CONFIG_FILE}: {e}")
+        UPSTREAM_REQUESTS.labels("tts", "error").inc()
+        logger.error("[DashScope TTS] Error during speech synthesis: %s", e)
+        return None, None
+    UPSTREAM_REQUESTS.labels("tts", "ok").inc()
 
-def save_keywords_config(config_data: dict):
+    sampling_rate = 16000 
     try:
-        with open(KEYWORD_CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config_data, f, ensure_ascii=False, indent=4)
-        print(f"[Backend] Saved keyword configurations to {KEYWORD_CONFIG_FILE}.")
+        with wave.open(io.BytesIO(wav_bytes), 'rb') as wf:
+            sampling_rate = wf.getframerate()
     except Exception as e:
-        print(f"[Backend] !!! Error saving keyword configurations: {e}")
+        logger.warning("[DashScope TTS] Could not read sampling rate from WAV header, using default 16000Hz: %s", e)
+
+    logger.debug("[DashScope TTS] Speech synthesized and downloaded successfully. (Sampling Rate: %s)", sampling_rate)
+    return wav_bytes, sampling_rate
+
+
+async def synthesize_speech(text: str):
+    """
+    Async wrapper around `synthesize_dashscope_tts`, fronted by the on-disk TTS cache.
+    Cache hits are read on the default executor and skip the TTS_SEMAPHORE queue entirely;
+    misses are synthesized with at most TTS_SEMAPHORE attempts in flight.
+    Returns a tuple of (WAV audio bytes, sampling rate).
+    """
+    loop = asyncio.get_running_loop()
+    cache_key = tts_cache_key(text, QWEN_TTS_VOICE_NAME, QWEN_TTS_LANGUAGE, QWEN_TTS_MODEL_NAME) if TTS_CACHE else None
+    if cache_key:
+        cached = await loop.run_in_executor(None, TTS_CACHE.get, cache_key)
+        if cached:
+            logger.debug("[DashScope TTS] Cache hit for: %r", text)
+            return cached
+
+    wav_bytes, sampling_rate = await synthesize_dashscope_tts(text)
+
+    if cache_key and wav_bytes is not None and sampling_rate is not None:
+        await loop.run_in_executor(None, TTS_CACHE.put, cache_key, wav_bytes, sampling_rate, text)
+    return wav_bytes, sampling_rate
+
+
+async def prewarm_tts_cache(templates):
+    """Synthesizes every keyword's response_template that isn't cached yet, so template replies start instantly."""
+    missing = [t for t in templates if tts_cache_key(t, QWEN_TTS_VOICE_NAME, QWEN_TTS_LANGUAGE, QWEN_TTS_MODEL_NAME) not in TTS_CACHE]
+    if not missing: return
+    logger.info("[DashScope TTS] Pre-warming audio cache with %d of %d response templates...", len(missing), len(templates))
+    for text in missing:
+        await synthesize_speech(text)
+    logger.info("[DashScope TTS] Pre-warm finished.", extra=TTS_CACHE.stats())
+
+def spawn_background_task(coro):
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return task
+
+
+def room_config_path(room_id: str) -> str:
+    return KEYWORD_CONFIG_FILE if room_id == DEFAULT_ROOM_ID else os.path.join(ROOM_CONFIG_DIR, f"{room_id}.json")
+
+def room_config_source(room: Room) -> str:
+    """The file a room's config is read from: its own, or the default room's until it has one."""
+    return room.config_path if os.path.exists(room.config_path) else KEYWORD_CONFIG_FILE
+
+def prune_idle_rooms():
+    """Drops rooms nobody has used for ROOM_IDLE_SECONDS, so arbitrary room ids can't pile up forever."""
+    now = time.monotonic()
+    for room in list(ROOMS.values()):
+        if room.room_id != DEFAULT_ROOM_ID and room.idle_for(now) > ROOM_IDLE_SECONDS:
+            del ROOMS[room.room_id]
+            if CONVERSATION_MEMORY_ENABLED:
+                CONVERSATION_MEMORY.forget_where(lambda key: key[0] == room.room_id)
+            logger.info("Dropped room %s, idle for %.0fs.", room.room_id, room.idle_for(now))
+
+async def get_room(room_id: str) -> Room:
+    """
+    Returns the room, creating it and loading its config on first use. `room_id` must be valid.
+    Raises ValueError when creating it would exceed MAX_ROOMS.
+    """
+    room = ROOMS.get(room_id)
+    if room is None:
+        prune_idle_rooms()
+        if len(ROOMS) >= MAX_ROOMS:
+            raise ValueError(f"Too many rooms (at most {MAX_ROOMS})")
+        room = ROOMS[room_id] = Room(room_id, room_config_path(room_id))
+        await reload_config(room)
+    elif not room.config.version:
+        async with room.config_lock: pass # Another connection is still loading it
+    room.last_active = time.monotonic()
+    return room
+
+async def build_config_snapshot(room: Room, full_config: dict) -> ConfigSnapshot:
+    """Compiles a new snapshot on the default executor. Raises ValueError for a malformed document."""
+    previous = room.config
+    return await asyncio.get_running_loop().run_in_executor(None, ConfigSnapshot, full_config, previous.version + 1, previous)
+
+def install_config_snapshot(room: Room, snapshot: ConfigSnapshot):
+    """Makes `snapshot` the room's live config. Coroutines still holding the old one finish with it."""
+    previous, room.config = room.config, snapshot
+    if previous.version and snapshot.fingerprint != previous.fingerprint:
+        # Cached replies need no invalidation: their keys hash the system prompt, which carries the
+        # persona and keyword data, so other rooms keep their hits. Earlier turns were answered
+        # under the old persona, though, so they shouldn't be sent along with new questions.
+        CONVERSATION_MEMORY.forget_where(lambda key: key[0] == room.room_id)
+        logger.info("Config of room %s changed, conversation memory invalidated.", room.room_id)
+    logger.info("Room %s config v%d active. Persona: %s, %d keywords", room.room_id, snapshot.version, snapshot.ai_settings["current_persona_name"], len(snapshot.keywords))
+    new_templates = set(snapshot.response_templates()) - set(previous.response_templates())
+    if TTS_CACHE and TTS_CACHE_PREWARM and new_templates:
+        spawn_background_task(prewarm_tts_cache(sorted(new_templates)))
+
+async def persist_config(room: Room, full_config: dict):
+    """Writes the document atomically to the room's own file and remembers the file's new signature."""
+    loop = asyncio.get_running_loop()
+    if room.config_path != KEYWORD_CONFIG_FILE:
+        await loop.run_in_executor(None, lambda: os.makedirs(os.path.dirname(room.config_path), exist_ok=True))
+    room.config_file_signature = await loop.run_in_executor(None, write_config_file, room.config_path, full_config)
+    room.config_source = room.config_path
+    logger.info("Saved keyword configurations of room %s to %s.", room.room_id, room.config_path)
+
+async def reload_config(room: Room):
+    """(Re)loads a room's config file without blocking the event loop; a broken file leaves the live config in place."""
+    loop = asyncio.get_running_loop()
+    async with room.config_lock:
+        source = room_config_source(room)
+        try:
+            full_config, signature = await loop.run_in_executor(None, read_config_file, source)
+        except FileNotFoundError:
+            logger.error("%s not found. Initializing with default config.", source)
+            full_config = copy.deepcopy(DEFAULT_CONFIG)
+            signature = await loop.run_in_executor(None, write_config_file, source, full_config)
+        except json.JSONDecodeError as e:
+            room.config_source, room.config_file_signature = source, file_signature(source) # Don't retry until the file changes again
+            logger.error("Could not decode %s, keeping the current config of room %s. Check JSON format: %s", source, room.room_id, e)
+            return
+        except OSError as e:
+            logger.error("Could not read %s, keeping the current config of room %s: %s", source, room.room_id, e)
+            return
+        room.config_source, room.config_file_signature = source, signature
+        try:
+            install_config_snapshot(room, await build_config_snapshot(room, full_config))
+        except ValueError as e:
+            logger.error("Invalid config in %s, keeping the current config of room %s: %s", source, room.room_id, e)
+            return
+        logger.info("Loaded keyword configurations of room %s from %s.", room.room_id, source)
+
+async def save_config(room: Room, full_config: dict) -> ConfigSnapshot:
+    """Replaces the room's whole config. The snapshot is compiled and the file written before anything goes live."""
+    async with room.config_lock:
+        snapshot = await build_config_snapshot(room, full_config)
+        await persist_config(room, full_config)
+        install_config_snapshot(room, snapshot)
+        return snapshot
+
+async def patch_config(room: Room, ops) -> ConfigSnapshot:
+    """
+    Applies incremental edits (see config_store.apply_config_patch) to the room's live config, all or nothing.
+    Raises ValueError unless `ops` is a non-empty list of valid edits.
+    """
+    if not isinstance(ops, list) or not ops:
+        raise ValueError("`ops` must be a non-empty list of patch objects")
+    async with room.config_lock:
+        full_config = room.config.full_config
+        for op in ops:
+            full_config = apply_config_patch(full_config, op)
+        snapshot = await build_config_snapshot(room, full_config)
+        await persist_config(room, full_config)
+        install_config_snapshot(room, snapshot)
+        return snapshot
+
+async def watch_config_files():
+    """
+    Reloads a room's config when its file is edited outside this process (mtime/size/inode polling).
+    Rooms that follow the default room's file pick up its changes the same way, as do rooms whose
+    own file appears or disappears.
+    """
+    pending = {} # room_id -> (source, signature) seen changed once, waiting to hold still
+    while True:
+        await asyncio.sleep(CONFIG_WATCH_INTERVAL_SECONDS)
+        prune_idle_rooms() # Don't keep polling the files of rooms nobody uses
+        for room_id in [room_id for room_id in pending if room_id not in ROOMS]:
+            del pending[room_id]
+        for room in list(ROOMS.values()):
+            source = room_config_source(room)
+            current = (source, file_signature(source))
+            if current[1] is None or current == (room.config_source, room.config_file_signature):
+                pending.pop(room.room_id, None)
+                continue
+            if pending.get(room.room_id) != current:
+                # Wait for the signature to hold still for one interval, so we don't read an editor's half-save
+                pending[room.room_id] = current
+                continue
+            logger.info("%s changed on disk, reloading room %s.", source, room.room_id)
+            try:
+                await reload_config(room)
+            except Exception as e:
+                logger.exception("Error reloading %s: %s", source, e)
+            pending.pop(room.room_id, None)
 
 
 # --- WebSocket Client Management ---
-CONNECTED_CLIENTS = set()
+WEBSOCKET_HOST = "localhost"
+WEBSOCKET_PORT = int(os.getenv("AI_BACKEND_PORT", "8080")) # Overridable so load tests can run beside a live backend
+CLIENT_SEND_QUEUE_SIZE = 32 # Messages buffered per client before the overflow policy kicks in
+CLIENT_OVERFLOW_POLICY = CLIENT_DROP_OLDEST # drop_oldest, drop_newest or coalesce (a newer config/metrics/stats snapshot replaces a queued one)
+CLIENT_EVICT_AFTER_DROPS = 16 # Disconnect a client after this many overflows without a successful send in between
+CLIENT_EVICT_LAG_SECONDS = 20 # ...or once its oldest unsent message is this old
 
-async def broadcast_ai_response(ai_response_content: str, mood: str, audio_data_raw: bytes, sampling_rate: int, original_comment_data: dict = None):
+# websocket -> ClientSession, over all rooms; each room also keeps its own group in `room.clients`.
+# Each session owns a bounded send queue, a writer task and the protocol options negotiated with
+# `set_protocol`; clients that never send it get the legacy format (one JSON frame with the WAV
+# inlined as `audio_base64`).
+CONNECTED_CLIENTS = {}
+
+async def broadcast_ai_response(room: Room, ai_response_content: str, mood: str, audio_data_raw: bytes, sampling_rate: int, original_comment_data: dict = None):
     """
-    Broadcasts the AI response to all connected clients.
+    Broadcasts the AI response to all clients in the room.
     `audio_data_raw` is expected to be raw WAV bytes.
     """
-    if not CONNECTED_CLIENTS:
-        print("[Backend] No clients connected to broadcast to.")
+    if not room.clients:
+        logger.info("No clients in room %s to broadcast to.", room.room_id)
         return
 
-    # Base64 encode the audio data here, just before sending
-    audio_base64 = base64.b64encode(audio_data_raw).decode('utf-8')
-
     ai_message_for_frontend = {
         "type": "ai_response",
         "content": ai_response_content,
         "mood": mood,
         "original_comment": original_comment_data,
-        "audio_base64": audio_base64,
         "sampling_rate": sampling_rate
     }
-    
-    message_to_send = json.dumps(ai_message_for_frontend, ensure_ascii=False)
-    
-    tasks = [client.send(message_to_send) for client in CONNECTED_CLIENTS]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    for result, client in zip(results, list(CONNECTED_CLIENTS)):
-        if isinstance(result, Exception):
-            print(f"[Backend] Error sending to client {client.remote_address}: {result}. Client will be removed.")
-        else:
-            print(f"[Backend] -> Sent AI response with audio to client {client.remote_address}")
+    await broadcast_with_audio(room, ai_message_for_frontend, audio_data_raw)
+
+async def broadcast_ai_response_chunk(room: Room, stream_id: int, seq: int, chunk_content: str, mood: str, audio_data_raw: bytes, sampling_rate: int, original_comment_data: dict = None, is_final: bool = False):
+    """
+    Broadcasts one sentence of a streamed reply as an `ai_response_chunk`.
+    Chunks of a stream share `stream_id` and are numbered by `seq`; the last message of a stream
+    has `is_final` set and may carry no audio.
+    """
+    if not room.clients: return
+    message = {
+        "type": "ai_response_chunk",
+        "stream_id": stream_id,
+        "seq": seq,
+        "is_final": is_final,
+        "content": chunk_content,
+        "mood": mood,
+        "original_comment": original_comment_data,
+        "sampling_rate": sampling_rate
+    }
+    if audio_data_raw:
+        await broadcast_with_audio(room, message, audio_data_raw)
+    else:
+        await broadcast_json(room, dict(message, audio_base64=None))
+
+async def broadcast_with_audio(room: Room, message: dict, wav_bytes: bytes):
+    """
+    Sends `message` plus audio to every client in the room, in the format it negotiated.
+    Base64 and each compressed encoding are produced at most once per broadcast, and the same
+    bytes object is handed to every client that wants it.
+    """
+    started = time.perf_counter()
+    sessions = list(room.clients.values())
+    frames_by_format = {}
+    frames_for_client = []
+    for session in sessions:
+        fmt = session.audio_format if session.binary_audio else "base64"
+        if fmt not in frames_by_format:
+            if fmt == "base64":
+                # Legacy clients: base64-encode the WAV here, just before sending
+                audio_base64 = base64.b64encode(wav_bytes).decode('utf-8')
+                frames = [json.dumps(dict(message, audio_base64=audio_base64), ensure_ascii=False)]
+                frames_by_format[fmt] = frames, frames_size(frames)
+            else:
+                audio_bytes, actual_fmt = wav_bytes, "wav"
+                if fmt != "wav":
+                    audio_bytes, actual_fmt = await asyncio.get_running_loop().run_in_executor(None, encode_audio, wav_bytes, fmt)
+                meta = dict(message, binary_audio=True, audio_format=actual_fmt, audio_mime=AUDIO_MIME_TYPES[actual_fmt], audio_size=len(audio_bytes))
+                frames = [json.dumps(meta, ensure_ascii=False), audio_bytes]
+                frames_by_format[fmt] = frames, frames_size(frames)
+        frames_for_client.append(frames_by_format[fmt])
+
+    send_to_clients(message["type"], sessions, frames_for_client)
+    STAGE_SECONDS.labels("broadcast").observe(time.perf_counter() - started)
+
+async def broadcast_json(room: Room, message: dict, coalesce_key=None):
+    frames = [json.dumps(message, ensure_ascii=False)]
+    sessions = list(room.clients.values())
+    send_to_clients(message["type"], sessions, [(frames, frames_size(frames))] * len(sessions), coalesce_key)
+
+def send_to_clients(message_type: str, sessions, frames_for_client, coalesce_key=None):
+    """
+    Hands a message to each client's own send queue; never waits on a slow client.
+    `frames_for_client` holds one (frames, size in bytes) pair per session.
+    """
+    for session, (frames, size) in zip(sessions, frames_for_client):
+        if session.enqueue(frames, coalesce_key, size):
+            logger.debug("-> Queued %s for client %s (queue depth %d)", message_type, session.remote_address, len(session))
+        elif not session.evicted:
+            logger.warning("Client %s send queue full, dropped %s.", session.remote_address, message_type)
+
+def send_json(websocket, message: dict, coalesce_key=None):
+    """Replies to a single client through its send queue, so replies never interleave with a broadcast's frames."""
+    session = CONNECTED_CLIENTS.get(websocket)
+    if session is not None:
+        session.enqueue([json.dumps(message, ensure_ascii=False)], coalesce_key)
 
 # Helper to check if a message is considered "meaningless"
-def is_meaningless(message: str) -> bool:
-    # Use filtering settings from the active persona
-    filtering_enabled = ai_settings.get("filtering_enabled", False)
-    if not filtering_enabled: return False
-    
-    min_length = ai_settings.get("min_message_length", 4)
-    if len(message) < min_length: return True
-    meaningless_patterns = ai_settings.get("meaningless_patterns", [])
-    for pattern in meaningless_patterns:
-        if pattern == message.strip() or (len(message.strip()) <= len(pattern) + 2 and pattern in message): return True
+def is_meaningless(message: str, config: ConfigSnapshot) -> bool:
+    # Uses the active persona's filter, compiled once per config snapshot
+    return config.meaningless_filter(message)
+
+def prepare_reply_job(dy_message: dict, room: Room):
+    """
+    Cheap, synchronous triage of a WebcastChatMessage: applies the meaningless filter or keyword
+    matching and builds the system prompt. Returns a job dict for the ingest queue, or None if the
+    comment should not be answered.
+    """
+    content = dy_message.get("content")
+    user_name = dy_message.get("user", {}).get("name", "Unknown User")
+    user_key = dy_message.get("user", {}).get("id") or user_name
+    if not content: return None
+
+    original_comment_info = {"user_name": user_name, "text": content}
+    config = room.config # One snapshot for the whole triage, even if a reload lands meanwhile
+
+    # Get persona-specific response mode and prompt
+    response_mode = config.ai_settings.get("response_mode", "keyword")
+    persona_prompt_base = config.ai_settings.get("persona_prompt", DEFAULT_PERSONA_PROMPT)
+
+    if response_mode == "free_qa":
+        with STAGE_SECONDS.labels("filter").time():
+            meaningless = is_meaningless(content, config)
+        if meaningless:
+            MESSAGES.labels("meaningless").inc()
+            logger.info("Skipped meaningless message from %s: %s", user_name, content)
+            return None
+        MESSAGES.labels("free_qa").inc()
+        logger.info("Free Q&A mode: Queued message from %s: %s", user_name, content)
+        return {
+            "content": content,
+            "user_key": user_key,
+            "user_message": f"用户说：'{content}'。",
+            "system_prompt": persona_prompt_base,
+            "prompt_parts": [persona_prompt_base],
+            "fallback_text": None,
+            "original_comment": original_comment_info,
+            "room_id": room.room_id,
+            "priority": PRIORITY_FREE_CHAT,
+            "received_at": time.monotonic(),
+        }
+
+    # Keyword mode (default)
+    current_keywords, matcher = config.keywords, config.keyword_matcher
+    with STAGE_SECONDS.labels("keyword_match").time():
+        matched_keywords = matcher.match(content, KEYWORD_MATCH_LONGEST_ONLY, KEYWORD_MATCH_SUPPRESS_OVERLAPS)
+    matched_configs = [(kw, current_keywords[kw]) for kw in matched_keywords if kw in current_keywords]
+    if not matched_configs:
+        MESSAGES.labels("no_match").inc()
+        return None
+    MESSAGES.labels("matched").inc()
+
+    priority = PRIORITY_KEYWORD
+    system_prompt_parts = [persona_prompt_base] # Start with persona's prompt
+    all_ai_contexts, all_response_templates, all_product_infos = [], [], []
+    for kw, cfg in matched_configs:
+        logger.info("Keyword %r detected from %s: %s", kw, user_name, content)
+        if cfg.get("ai_context"): all_ai_contexts.append(cfg["ai_context"])
+        if cfg.get("response_template"): all_response_templates.append(f"当用户提到'{kw}'时，可以参考以下内容：'{cfg['response_template']}'")
+        if cfg.get("type") == "product_info":
+            priority = PRIORITY_PRODUCT
+            all_product_infos.append(f"{cfg.get('product_name', '商品')} 价格: {cfg.get('price', '未知价格')}, 购买方式: {cfg.get('selling_method', '请咨询主播')}")
+    if all_ai_contexts: system_prompt_parts.append(f"根据以下额外指示进行回复：{' '.join(all_ai_contexts)}")
+    if all_response_templates: system_prompt_parts.append(f"请特别注意，综合参考以下内容进行回复，并根据用户具体语境进行灵活调整：{' '.join(all_response_templates)}")
+    if all_product_infos: system_prompt_parts.append(f"以下是用户可能感兴趣的产品信息：{' '.join(all_product_infos)}。请根据用户提问，结合这些信息进行回答。")
+
+    return {
+        "content": content,
+        "user_key": user_key,
+        "user_message": f"用户说：'{content}'。",
+        "system_prompt": "\n".join(system_prompt_parts),
+        "prompt_parts": system_prompt_parts,
+        # Spoken verbatim if DeepSeek is unavailable (circuit open or retries exhausted)
+        "fallback_text": next((cfg["response_template"] for _, cfg in matched_configs if cfg.get("response_template")), None),
+        "original_comment": original_comment_info,
+        "room_id": room.room_id,
+        "priority": priority,
+        "received_at": time.monotonic(),
+    }
+
+async def response_cache_get(key):
+    # The shared SQLite cache can wait seconds for another worker's write lock: keep that off the event loop
+    if RESPONSE_CACHE_SHARED:
+        return await asyncio.get_running_loop().run_in_executor(None, RESPONSE_CACHE.get, key)
+    return RESPONSE_CACHE.get(key)
+
+async def response_cache_put(key, value):
+    if RESPONSE_CACHE_SHARED:
+        await asyncio.get_running_loop().run_in_executor(None, RESPONSE_CACHE.put, key, value)
+    else:
+        RESPONSE_CACHE.put(key, value)
+
+async def process_reply_job(job: dict):
+    """Runs a queued reply job through (response cache | LLM) -> TTS -> broadcast to the job's room."""
+    room = ROOMS.get(job["room_id"])
+    if room is None:
+        logger.info("Room %s was dropped, skipping its queued reply.", job["room_id"])
+        return
+    # Batched jobs answer several viewers at once and have no user_key, so they neither read nor feed memory
+    memory_key = (job["room_id"], job["user_key"]) if CONVERSATION_MEMORY_ENABLED and job["user_key"] else None
+    history = CONVERSATION_MEMORY.history(memory_key) if memory_key else []
+    cache_key = RESPONSE_CACHE.make_key(job["content"], job["system_prompt"], history) if RESPONSE_CACHE_ENABLED else None
+    cached = await response_cache_get(cache_key) if cache_key else None
+    if cached:
+        logger.info("Response cache hit for %r (hit rate %.0f%%)", job['content'], RESPONSE_CACHE.hit_rate() * 100)
+
+    if STREAMING_MODE:
+        await process_reply_job_streaming(room, job, cache_key, cached, memory_key, history)
+        return
+
+    if cached:
+        ai_response_content, mood = cached
+    else:
+        ai_response_content, mood = await get_ai_response(job["user_message"], job["system_prompt"], history)
+        if cache_key and ai_response_content:
+            await response_cache_put(cache_key, (ai_response_content, mood))
+    if memory_key and ai_response_content:
+        CONVERSATION_MEMORY.record(memory_key, job["user_message"], f"[{mood}]{ai_response_content}")
+    if not ai_response_content and job["fallback_text"]:
+        UPSTREAM_REQUESTS.labels("llm", "fallback").inc()
+        logger.warning("AI unavailable, falling back to response_template: %s", job['fallback_text'])
+        ai_response_content, mood = job["fallback_text"], "neutral"
+
+    if ai_response_content:
+        wav_bytes, sampling_rate = await synthesize_speech(ai_response_content)
+        if wav_bytes is not None and sampling_rate is not None:
+            await broadcast_ai_response(room, ai_response_content, mood, wav_bytes, sampling_rate, job["original_comment"])
+            time_to_first_audio = time.monotonic() - job['received_at']
+            TIME_TO_FIRST_AUDIO_SECONDS.labels("full").observe(time_to_first_audio)
+            logger.info("Time to first audio: %.2fs (full reply)", time_to_first_audio)
+
+async def process_reply_job_streaming(room: Room, job: dict, cache_key, cached, memory_key=None, history=()):
+    """
+    Streaming path: sentences are cut from the LLM token stream as they complete, synthesized
+    concurrently (bounded by TTS_SEMAPHORE) and broadcast strictly in order as `ai_response_chunk`s.
+    """
+    stream_id = next(STREAM_IDS)
+    synth_tasks = asyncio.Queue() # (chunk text, TTS task) in sentence order; None marks the end
+    mood = cached[1] if cached else "neutral"
+    used_fallback = False
+
+    async def produce():
+        nonlocal mood, used_fallback
+        def enqueue(chunks):
+            for chunk in chunks:
+                synth_tasks.put_nowait((chunk, asyncio.create_task(synthesize_speech(chunk))))
+
+        try:
+            if cached:
+                enqueue(split_sentences(cached[0], final=True)[0])
+                return
+
+            buffer, mood_parsed = "", False
+            async for delta in stream_ai_response(job["user_message"], job["system_prompt"], history):
+                buffer += delta
+                if not mood_parsed:
+                    # Hold text back until the [mood] prefix is complete (or clearly absent)
+                    if buffer.lstrip().startswith("[") and "]" not in buffer and len(buffer) < MOOD_PREFIX_MAX_CHARS: continue
+                    buffer, mood = parse_mood_prefix(buffer)
+                    mood_parsed = True
+                chunks, buffer = split_sentences(buffer)
+                enqueue(chunks)
+            if not mood_parsed:
+                buffer, mood = parse_mood_prefix(buffer)
+            enqueue(split_sentences(buffer, final=True)[0])
+        except Exception as e:
+            if isinstance(e, CircuitOpenError):
+                UPSTREAM_REQUESTS.labels("llm", "circuit_open").inc()
+            logger.error("Error streaming AI response: %s", e)
+        finally:
+            if synth_tasks.empty() and not spoken and job["fallback_text"]:
+                UPSTREAM_REQUESTS.labels("llm", "fallback").inc()
+                logger.warning("AI unavailable, falling back to response_template: %s", job['fallback_text'])
+                mood, used_fallback = "neutral", True
+                enqueue(split_sentences(job["fallback_text"], final=True)[0])
+            synth_tasks.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    seq, spoken, first_audio_at = 0, [], None
+    try:
+        while (item := await synth_tasks.get()) is not None:
+            chunk, tts_task = item
+            spoken.append(chunk)
+            wav_bytes, sampling_rate = await tts_task
+            if wav_bytes is None or sampling_rate is None: continue
+            await broadcast_ai_response_chunk(room, stream_id, seq, chunk, mood, wav_bytes, sampling_rate, job["original_comment"])
+            if first_audio_at is None:
+                first_audio_at = time.monotonic()
+                TIME_TO_FIRST_AUDIO_SECONDS.labels("streaming").observe(first_audio_at - job['received_at'])
+                logger.info("Time to first audio: %.2fs (streaming, stream %d)", first_audio_at - job['received_at'], stream_id)
+            seq += 1
+    finally:
+        await producer
+
+    full_reply = "".join(spoken)
+    if spoken:
+        await broadcast_ai_response_chunk(room, stream_id, seq, full_reply, mood, None, None, job["original_comment"], is_final=True)
+        logger.info("<- AI Response streamed in %d chunk(s) (Mood: %s): %s", seq, mood, full_reply)
+    if full_reply and not used_fallback:
+        if cache_key and not cached:
+            await response_cache_put(cache_key, (full_reply, mood))
+        if memory_key:
+            CONVERSATION_MEMORY.record(memory_key, job["user_message"], f"[{mood}]{full_reply}")
+
+def merge_reply_jobs(jobs):
+    """Folds several pending questions into one job that asks the LLM for a single combined answer."""
+    prompt_parts = []
+    for job in jobs:
+        for part in job["prompt_parts"]:
+            if part not in prompt_parts: prompt_parts.append(part)
+    questions = "\n".join(f"{i}. {job['original_comment']['user_name']}说：'{job['content']}'" for i, job in enumerate(jobs, 1))
+    contents = " / ".join(job["content"] for job in jobs)
+    return {
+        "content": contents,
+        "user_key": None,
+        "user_message": f"直播间有几位观众同时在问：\n{questions}\n请用一段简短的话一并回答他们。",
+        "system_prompt": "\n".join(prompt_parts),
+        "prompt_parts": prompt_parts,
+        "fallback_text": next((job["fallback_text"] for job in jobs if job["fallback_text"]), None),
+        "original_comment": {"user_name": "、".join(dict.fromkeys(job["original_comment"]["user_name"] for job in jobs)), "text": contents},
+        "room_id": jobs[0]["room_id"],
+        "priority": max(job["priority"] for job in jobs),
+        "received_at": min(job["received_at"] for job in jobs),
+        "batch_size": len(jobs),
+    }
+
+async def collect_reply_batch(first_job: dict):
+    same_room = lambda job: job["room_id"] == first_job["room_id"] # Only questions asked in one room share an answer
+    batch = [first_job]
+    while len(batch) < REPLY_BATCH_MAX_SIZE and (job := INGEST_QUEUE.get_nowait(same_room)) is not None:
+        batch.append(job)
+    if len(batch) < REPLY_BATCH_MAX_SIZE and REPLY_BATCH_WINDOW_SECONDS:
+        await asyncio.sleep(REPLY_BATCH_WINDOW_SECONDS)
+        while len(batch) < REPLY_BATCH_MAX_SIZE and (job := INGEST_QUEUE.get_nowait(same_room)) is not None:
+            batch.append(job)
+    return batch
+
+async def ingest_worker():
+    while True:
+        # Budget is waited for before a job is taken, so waiting jobs stay subject to expiry and shedding
+        batch = [await REPLY_SCHEDULER.next_budgeted(INGEST_QUEUE.get)]
+        STAGE_SECONDS.labels("queue_wait").observe(time.monotonic() - batch[0]["received_at"])
         try:
-            if re.search(re.escape(pattern), message, re.IGNORECASE):
-                if len(message.strip()) / len(pattern) < 2: return True
-        except re.error: pass
-    if len(message) > 2 and len(set(message.lower())) <= 2: return True
-    return False
+            if REPLY_BATCHING_ENABLED:
+                batch = await collect_reply_batch(batch[0])
+            job = merge_reply_jobs(batch) if len(batch) > 1 else batch[0]
+            if len(batch) > 1:
+                logger.info("Merged %d questions into one reply: %s", len(batch), job['content'])
+            await process_reply_job(job)
+        except Exception as e:
+            logger.exception("Error processing chat message: %s", e)
+        finally:
+            for _ in batch: INGEST_QUEUE.mark_processed()
+
+def start_ingest_workers():
+    for _ in range(INGEST_WORKERS - len(INGEST_WORKER_TASKS)):
+        INGEST_WORKER_TASKS.append(asyncio.create_task(ingest_worker()))
+
+def ingest_chat_message(dy_message: dict, room: Room):
+    """Triage inline, then hand off to the bounded queue; workers do the slow LLM/TTS stages."""
+    job = prepare_reply_job(dy_message, room)
+    if job is None: return
+    admitted, reason = REPLY_SCHEDULER.admit(job["user_key"], job["content"], scope=room.room_id)
+    if not admitted:
+        MESSAGES.labels(reason).inc()
+        logger.info("Skipped comment (%s) from %s: %s", reason, job['original_comment']['user_name'], job['content'])
+    elif not INGEST_QUEUE.put(job, job["priority"]):
+        MESSAGES.labels("shed").inc()
+        logger.warning("Ingest queue full, shed comment: %s", job['original_comment']['text'])
+    else:
+        MESSAGES.labels("queued").inc()
+
+def register_state_metrics():
+    """Scrape-time views of state that other components already track."""
+    METRICS.callback("connected_clients", "Connected WebSocket clients.", lambda: len(CONNECTED_CLIENTS))
+    METRICS.callback("client_send_queue_depth", "Messages waiting in client send queues, summed over clients.",
+                     lambda: sum(len(s) for s in CONNECTED_CLIENTS.values()))
+    METRICS.callback("ingest_queue_depth", "Comments waiting for a reply.", lambda: len(INGEST_QUEUE))
+    METRICS.callback("room_clients", "Connected WebSocket clients per room.", lambda: {room_id: len(room.clients) for room_id, room in ROOMS.items()}, label_name="room")
+    METRICS.callback("config_version", "Version of each room's live config snapshot; bumps on every load, save or patch.",
+                     lambda: {room_id: room.config.version for room_id, room in ROOMS.items()}, label_name="room")
+    METRICS.callback("ingest_queue_items", "Ingest queue items by fate.",
+                     lambda: {k: v for k, v in INGEST_QUEUE.stats().items() if k in ("enqueued", "dropped", "expired", "processed")},
+                     type="counter", label_name="outcome")
+    METRICS.callback("circuit_open", "1 while an upstream's circuit breaker is open or half-open.",
+                     lambda: {"llm": int(LLM_BREAKER.state != LLM_BREAKER.CLOSED), "tts": int(TTS_BREAKER.state != TTS_BREAKER.CLOSED)},
+                     label_name="upstream")
+    METRICS.callback("response_cache_lookups", "Response cache lookups by result.",
+                     lambda: {"hit": RESPONSE_CACHE.hits, "miss": RESPONSE_CACHE.misses}, type="counter", label_name="result")
+    if CONVERSATION_MEMORY_ENABLED:
+        METRICS.callback("conversation_memory_users", "Viewers with remembered turns.", lambda: len(CONVERSATION_MEMORY))
+        METRICS.callback("conversation_memory_lookups", "Memory lookups, by whether any history was sent along.",
+                         lambda: {"with_history": CONVERSATION_MEMORY.lookups_with_history, "without_history": CONVERSATION_MEMORY.lookups - CONVERSATION_MEMORY.lookups_with_history},
+                         type="counter", label_name="result")
+        METRICS.callback("conversation_memory_evictions", "Viewers forgotten, by reason.", lambda: CONVERSATION_MEMORY.evictions, type="counter", label_name="reason")
+    if TTS_CACHE:
+        METRICS.callback("tts_cache_lookups", "TTS audio cache lookups by result.",
+                         lambda: {"hit": TTS_CACHE.hits, "miss": TTS_CACHE.misses}, type="counter", label_name="result")
+        METRICS.callback("tts_cache_bytes", "Bytes of audio in the TTS cache.", lambda: TTS_CACHE.stats()["bytes"])
+
+def get_metrics_snapshot() -> dict:
+    """What the `get_metrics` action returns: all metrics plus the components' own stats."""
+    return {
+        "metrics": METRICS.snapshot(),
+        "rooms": {room_id: room.stats() for room_id, room in ROOMS.items()},
+        "ingest_queue": INGEST_QUEUE.stats(),
+        "reply_scheduler": REPLY_SCHEDULER.stats(),
+        "response_cache": RESPONSE_CACHE.stats(),
+        "conversation_memory": CONVERSATION_MEMORY.stats() if CONVERSATION_MEMORY_ENABLED else None,
+        "tts_cache": TTS_CACHE.stats() if TTS_CACHE else None,
+        "upstreams": {"llm": LLM_BREAKER.stats(), "tts": TTS_BREAKER.stats()},
+    }
+
+register_state_metrics()
+
+async def resolve_config_room(message_obj: dict, session: ClientSession) -> Room:
+    """Config actions apply to the client's room, or to the room named by an optional `room_id`."""
+    room_id = message_obj.get("room_id", session.room_id)
+    if not valid_room_id(room_id):
+        raise ValueError(f"Invalid room id: {room_id!r}")
+    return await get_room(room_id)
+
+def leave_room(websocket, session: ClientSession):
+    room = ROOMS.get(session.room_id)
+    if room is not None and room.clients.pop(websocket, None) is not None:
+        room.last_active = time.monotonic()
+
+def join_room(websocket, session: ClientSession, room: Room):
+    leave_room(websocket, session)
+    session.room_id = room.room_id
+    room.clients[websocket] = session
 
 async def handler(websocket):
-    CONNECTED_CLIENTS.add(websocket)
-    print(f"[Backend] Client connected from {websocket.remote_address}. Total clients: {len(CONNECTED_CLIENTS)}")
+    room_id = room_id_from_path(websocket.request.path) or DEFAULT_ROOM_ID
+    if not valid_room_id(room_id):
+        logger.warning("Client %s asked for invalid room %r, using %s.", websocket.remote_address, room_id, DEFAULT_ROOM_ID)
+        room_id = DEFAULT_ROOM_ID
+    try:
+        room = await get_room(room_id)
+    except ValueError as e:
+        logger.warning("Client %s can't open room %s (%s), using %s.", websocket.remote_address, room_id, e, DEFAULT_ROOM_ID)
+        room = await get_room(DEFAULT_ROOM_ID)
+    session = ClientSession(websocket, CLIENT_SEND_QUEUE_SIZE, CLIENT_OVERFLOW_POLICY, CLIENT_EVICT_AFTER_DROPS, CLIENT_EVICT_LAG_SECONDS)
+    session.start()
+    CONNECTED_CLIENTS[websocket] = session
+    join_room(websocket, session, room)
+    logger.info("Client connected from %s to room %s. Total clients: %d", websocket.remote_address, room.room_id, len(CONNECTED_CLIENTS))
     try:
         async for message in websocket:
             try:
@@ -270,22 +1097,76 @@ async def handler(websocket):
 
                 if isinstance(message_obj, dict) and message_obj.get("action"):
                     action = message_obj["action"]
-                    if action == "get_config":
-                        await websocket.send(json.dumps({"type": "config_update", "data": full_config}, ensure_ascii=False))
-                        print("[Backend] Sent config to client.")
+                    if action == "join_room":
+                        # {"action": "join_room", "room_id": "shop_a"}: later comments and broadcasts use that room
+                        if not valid_room_id(message_obj.get("room_id")):
+                            send_json(websocket, {"type": "room_error", "message": f"Invalid room id: {message_obj.get('room_id')!r}"})
+                            continue
+                        try:
+                            room = await get_room(message_obj["room_id"])
+                        except ValueError as e:
+                            send_json(websocket, {"type": "room_error", "message": str(e)})
+                            continue
+                        join_room(websocket, session, room)
+                        send_json(websocket, {"type": "room_joined", "room_id": room.room_id, "persona": room.config.ai_settings["current_persona_name"]})
+                        logger.info("Client %s joined room %s.", websocket.remote_address, room.room_id)
+                        continue
+                    elif action == "get_config":
+                        try:
+                            config_room = await resolve_config_room(message_obj, session)
+                        except ValueError as e:
+                            send_json(websocket, {"type": "config_error", "message": str(e)})
+                            continue
+                        send_json(websocket, {"type": "config_update", "room_id": config_room.room_id, "data": config_room.config.full_config},
+                                  coalesce_key=("config_update", config_room.room_id))
+                        logger.info("Sent config of room %s to client.", config_room.room_id)
                         continue
                     elif action == "save_config" and "data" in message_obj:
-                        save_keywords_config(message_obj["data"])
-                        load_keywords_config()
-                        await websocket.send(json.dumps({"type": "config_saved", "message": "Configuration saved and reloaded."}, ensure_ascii=False))
-                        print("[Backend] Received and saved new config from client.")
+                        try:
+                            config_room = await resolve_config_room(message_obj, session)
+                            await save_config(config_room, message_obj["data"])
+                        except (ValueError, OSError) as e:
+                            logger.error("Rejected config from client: %s", e)
+                            send_json(websocket, {"type": "config_error", "message": str(e)})
+                            continue
+                        send_json(websocket, {"type": "config_saved", "message": "Configuration saved and reloaded."})
+                        logger.info("Received and saved new config of room %s from client.", config_room.room_id)
+                        continue
+                    elif action == "patch_config":
+                        # {"action": "patch_config", "op": "set_keyword", "keyword": ..., "value": {...}}, or several as "ops": [...]
+                        try:
+                            config_room = await resolve_config_room(message_obj, session)
+                            snapshot = await patch_config(config_room, message_obj["ops"] if "ops" in message_obj else [message_obj])
+                        except (ValueError, OSError) as e:
+                            logger.error("Rejected config patch from client: %s", e)
+                            send_json(websocket, {"type": "config_error", "message": str(e)})
+                            continue
+                        send_json(websocket, {"type": "config_patched", "room_id": config_room.room_id, "version": snapshot.version})
+                        continue
+                    elif action == "set_protocol":
+                        # e.g. {"action": "set_protocol", "binary_audio": true, "audio_formats": ["opus", "mp3", "wav"]}
+                        session.binary_audio = bool(message_obj.get("binary_audio", False))
+                        session.audio_format = choose_format(message_obj.get("audio_formats", ["wav"]))
+                        send_json(websocket, {
+                            "type": "protocol_set",
+                            "binary_audio": session.binary_audio,
+                            "audio_format": session.audio_format,
+                            "available_formats": available_formats(),
+                        })
+                        logger.info("Client %s protocol: binary_audio=%s, format=%s", websocket.remote_address, session.binary_audio, session.audio_format)
+                        continue
+                    elif action == "get_client_stats":
+                        send_json(websocket, {"type": "client_stats", "data": [s.stats() for s in CONNECTED_CLIENTS.values()]}, coalesce_key="client_stats")
+                        continue
+                    elif action == "get_metrics":
+                        send_json(websocket, {"type": "metrics", "data": get_metrics_snapshot()}, coalesce_key="metrics")
                         continue
                     elif action == "test_speech" and "text" in message_obj:
                         test_text = message_obj["text"]
                         test_mood = message_obj.get("mood", "neutral")
-                        wav_bytes, sampling_rate = synthesize_dashscope_tts(test_text)
+                        wav_bytes, sampling_rate = await synthesize_speech(test_text)
                         if wav_bytes is not None and sampling_rate is not None:
-                            await broadcast_ai_response(test_text, test_mood, wav_bytes, sampling_rate, {"user_name": "测试用户", "text": "语音测试"})
+                            await broadcast_ai_response(ROOMS[session.room_id], test_text, test_mood, wav_bytes, sampling_rate, {"user_name": "测试用户", "text": "语音测试"})
                         continue
 
                 
@@ -293,99 +1174,127 @@ async def handler(websocket):
 
                 for dy_message in message_obj:
                     if dy_message.get("method") == "WebcastChatMessage":
-                        content = dy_message.get("content")
-                        user_name = dy_message.get("user", {}).get("name", "Unknown User")
-                        
-                        if content:
-                            ai_response_content, mood = None, "neutral"
-                            original_comment_info = {"user_name": user_name, "text": content}
-                            
-                            # Get persona-specific response mode and prompt
-                            response_mode = ai_settings.get("response_mode", "keyword")
-                            persona_prompt_base = ai_settings.get("persona_prompt", "你是一个直播间助手，你的名字叫“弹幕鸭”。请用友好、简洁、幽默的风格回答问题。")
-
-                            if response_mode == "free_qa":
-                                if is_meaningless(content):
-                                    print(f"[Backend] Skipped meaningless message from {user_name}: {content}")
-                                    continue
-                                print(f"[Backend] Free Q&A mode: Processing message from {user_name}: {content}")
-                                ai_response_content, mood = await get_ai_response(f"用户说：'{content}'。", persona_prompt_base)
-
-                            else: # Keyword mode (default)
-                                matched_configs = [(kw, cfg) for kw, cfg in keywords_config.items() if kw in content]
-                                if matched_configs:
-                                    system_prompt_parts = [persona_prompt_base] # Start with persona's prompt
-                                    all_ai_contexts, all_response_templates, all_product_infos = [], [], []
-                                    for kw, cfg in matched_configs:
-                                        print(f"[Backend] !!! Keyword '{kw}' detected from {user_name}: {content}")
-                                        if cfg.get("ai_context"): all_ai_contexts.append(cfg["ai_context"])
-                                        if cfg.get("response_template"): all_response_templates.append(f"当用户提到'{kw}'时，可以参考以下内容：'{cfg['response_template']}'")
-                                        if cfg.get("type") == "product_info":
-                                            all_product_infos.append(f"{cfg.get('product_name', '商品')} 价格: {cfg.get('price', '未知价格')}, 购买方式: {cfg.get('selling_method', '请咨询主播')}")
-                                    if all_ai_contexts: system_prompt_parts.append(f"根据以下额外指示进行回复：{' '.join(all_ai_contexts)}")
-                                    if all_response_templates: system_prompt_parts.append(f"请特别注意，综合参考以下内容进行回复，并根据用户具体语境进行灵活调整：{' '.join(all_response_templates)}")
-                                    if all_product_infos: system_prompt_parts.append(f"以下是用户可能感兴趣的产品信息：{' '.join(all_product_infos)}。请根据用户提问，结合这些信息进行回答。")
-                                    
-                                    final_system_prompt = "\n".join(system_prompt_parts)
-                                    ai_response_content, mood = await get_ai_response(f"用户说：'{content}'。", final_system_prompt)
-                            
-                            if ai_response_content:
-                                wav_bytes, sampling_rate = synthesize_dashscope_tts(ai_response_content)
-                                if wav_bytes is not None and sampling_rate is not None:
-                                    await broadcast_ai_response(ai_response_content, mood, wav_bytes, sampling_rate, original_comment_info)
+                        MESSAGES.labels("received").inc()
+                        with STAGE_SECONDS.labels("ingest").time():
+                            ingest_chat_message(dy_message, ROOMS[session.room_id])
 
             except json.JSONDecodeError: pass
-            except Exception as e: print(f"[Backend] Error processing message: {e}")
+            except Exception as e: logger.exception("Error processing message: %s", e)
+    except websockets.exceptions.ConnectionClosed: pass # Includes clients we evicted as slow consumers
     finally:
-        CONNECTED_CLIENTS.remove(websocket)
-        print(f"[Backend] Client disconnected from {websocket.remote_address}. Total clients: {len(CONNECTED_CLIENTS)}")
+        CONNECTED_CLIENTS.pop(websocket, None)
+        leave_room(websocket, session)
+        await session.stop()
+        logger.info("Client disconnected from %s. Total clients: %d", websocket.remote_address, len(CONNECTED_CLIENTS))
+
+async def supervise_worker(index: int, env: dict):
+    """Runs one worker process of the sharded setup, restarting it whenever it exits."""
+    while True:
+        process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), env=env, stdin=asyncio.subprocess.DEVNULL)
+        try:
+            code = await process.wait()
+        except asyncio.CancelledError:
+            process.terminate()
+            raise
+        logger.error("Worker %d exited with code %s, restarting in %ss.", index, code, WORKER_RESTART_DELAY_SECONDS)
+        await asyncio.sleep(WORKER_RESTART_DELAY_SECONDS)
+
+async def serve_sharded():
+    """
+    Front process of worker mode: starts WORKER_PROCESSES backends on the ports after WEBSOCKET_PORT
+    and pipes every client connection to the one that owns its room (see room_router).
+    """
+    worker_urls = []
+    for index in range(WORKER_PROCESSES):
+        port = WEBSOCKET_PORT + 1 + index
+        env = dict(
+            os.environ,
+            AI_BACKEND_WORKERS="0",
+            AI_BACKEND_WORKER_INDEX=str(index),
+            AI_BACKEND_WORKER_COUNT=str(WORKER_PROCESSES),
+            AI_BACKEND_PORT=str(port),
+            METRICS_PORT=str(METRICS_PORT + 1 + index if METRICS_PORT else 0),
+            RESPONSE_CACHE_SHARED="1",
+            DEEPSEEK_API_KEY=DEEPSEEK_API_KEY,
+            DASH_SCOPE_API_KEY=DASHSCOPE_API_KEY,
+        )
+        spawn_background_task(supervise_worker(index, env))
+        worker_urls.append(f"ws://{WEBSOCKET_HOST}:{port}")
+        logger.info("Worker %d on %s (metrics port %s)", index, worker_urls[-1], env["METRICS_PORT"])
+
+    stop = asyncio.get_running_loop().create_future()
+    try:
+        # Leave through asyncio.run's cleanup on SIGTERM too, so supervise_worker() stops the workers
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: stop.done() or stop.set_result(None))
+    except NotImplementedError:
+        pass # Windows: Ctrl+C reaches the workers directly
+
+    logger.info("启动 AI WebSocket 后端在 ws://%s:%d (%d worker processes)", WEBSOCKET_HOST, WEBSOCKET_PORT, WORKER_PROCESSES)
+    async with websockets.serve(lambda websocket: proxy_connection(websocket, worker_urls), WEBSOCKET_HOST, WEBSOCKET_PORT, max_size=None):
+        await stop
 
 async def main():
     global DEEPSEEK_API_KEY, DASHSCOPE_API_KEY
 
+    configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_RATE_LIMIT_BURST, LOG_RATE_LIMIT_INTERVAL_SECONDS,
+                      {"worker": WORKER_INDEX} if WORKER_INDEX is not None else None)
+    logging.getLogger("websockets").setLevel(logging.WARNING) # Its per-connection lines duplicate ours
+
     # 1. Try to load from api_config.py
     if api_config:
         DEEPSEEK_API_KEY = getattr(api_config, "DEEPSEEK_API_KEY", None)
         DASHSCOPE_API_KEY = getattr(api_config, "DASH_SCOPE_API_KEY", None)
         if DEEPSEEK_API_KEY and DASHSCOPE_API_KEY:
-            print("[Backend] Loaded API keys from api_config.py")
+            logger.info("Loaded API keys from api_config.py")
 
     # 2. If not found in api_config.py, try environment variables
     if not DEEPSEEK_API_KEY:
         DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
         if DEEPSEEK_API_KEY:
-            print("[Backend] Loaded DeepSeek API Key from environment variable DEEPSEEK_API_KEY")
+            logger.info("Loaded DeepSeek API Key from environment variable DEEPSEEK_API_KEY")
     if not DASHSCOPE_API_KEY:
         DASHSCOPE_API_KEY = os.getenv("DASH_SCOPE_API_KEY")
         if DASHSCOPE_API_KEY:
-            print("[Backend] Loaded DashScope API Key from environment variable DASH_SCOPE_API_KEY")
+            logger.info("Loaded DashScope API Key from environment variable DASH_SCOPE_API_KEY")
 
     # 3. If still not found, prompt the user
     if not DEEPSEEK_API_KEY:
         DEEPSEEK_API_KEY = input("请输入 DeepSeek API Key: ").strip()
         if not DEEPSEEK_API_KEY:
-            print("未提供 DeepSeek API Key。退出。")
+            logger.error("未提供 DeepSeek API Key。退出。")
             return
     if not DASHSCOPE_API_KEY:
         DASHSCOPE_API_KEY = input("请输入 DashScope API Key: ").strip()
         if not DASHSCOPE_API_KEY:
-            print("未提供 DashScope API Key。退出。")
+            logger.error("未提供 DashScope API Key。退出。")
             return
 
+    if WORKER_PROCESSES:
+        await serve_sharded()
+        return
+
     dashscope.api_key = DASHSCOPE_API_KEY
-    dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1' # Assuming China region
-
-    load_keywords_config()
-    
-    print("启动 AI WebSocket 后端在 ws://localhost:8080")
-    print(f"当前激活角色: {ai_settings.get('current_persona_name', '未知')}")
-    print(f"当前响应模式: {ai_settings.get('response_mode', 'keyword')}")
-    if ai_settings.get("response_mode") == "keyword":
-        print(f"监听 {len(keywords_config)} 个已配置的关键词。")
+    dashscope.base_http_api_url = DASHSCOPE_BASE_URL
+
+    config = (await get_room(DEFAULT_ROOM_ID)).config
+
+    logger.info("启动 AI WebSocket 后端在 ws://%s:%d", WEBSOCKET_HOST, WEBSOCKET_PORT)
+    logger.info("当前激活角色: %s", config.ai_settings.get('current_persona_name', '未知'))
+    logger.info("当前响应模式: %s", config.ai_settings.get('response_mode', 'keyword'))
+    if config.ai_settings.get("response_mode") == "keyword":
+        logger.info("监听 %d 个已配置的关键词。", len(config.keywords))
     else:
-        print(f"自由问答模式已启用，过滤: {ai_settings.get('filtering_enabled', False)}")
+        logger.info("自由问答模式已启用，过滤: %s", config.ai_settings.get('filtering_enabled', False))
         
-    async with websockets.serve(handler, "localhost", 8080):
+    start_ingest_workers()
+    if CONFIG_WATCH_INTERVAL_SECONDS:
+        spawn_background_task(watch_config_files())
+    logger.info("Ingest queue: capacity %d, policy %s, max age %ss, %d workers", INGEST_QUEUE_CAPACITY, INGEST_DROP_POLICY, INGEST_MAX_AGE_SECONDS, INGEST_WORKERS)
+    if METRICS_PORT:
+        metrics_server = await start_metrics_server(METRICS, METRICS_HOST, METRICS_PORT) # Referenced for as long as main() serves
+        logger.info("Metrics endpoint at http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
+
+    async with websockets.serve(handler, WEBSOCKET_HOST, WEBSOCKET_PORT):
         await asyncio.Future()
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import httpx
+import requests
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, Timeout
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls are refused for
+    `reset_timeout` seconds; then a single trial call is let through (half-open). Its success
+    closes the circuit again, its failure re-opens it. Thread-safe, so it may also be used from
+    executor threads.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+        self.failures = 0
+        self.successes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._consecutive_failures = 0
+            if self._state != self.CLOSED:
+                logger.warning("%s circuit closed, upstream recovered", self.name, extra={"upstream": self.name})
+            self._state = self.CLOSED
+            self._trial_in_flight = False
+
+    def record_neutral(self):
+        """The call failed in a way that says nothing about upstream health (e.g. a 400): state is kept,
+        only a half-open trial slot is freed so the next call can try."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened += 1
+                    logger.warning("%s circuit opened after %d consecutive failure(s); retrying in %.0fs",
+                                   self.name, self._consecutive_failures, self.reset_timeout, extra={"upstream": self.name})
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "opened": self.opened,
+        }
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(max_delay, base * 2^attempt)]."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def always_retryable(error: Exception) -> bool:
+    return True
+
+
+async def call_with_retries_async(fn, breaker: CircuitBreaker, attempts: int = 3, base_delay: float = 0.3, max_delay: float = 3.0,
+                                  is_retryable=always_retryable):
+    """
+    Awaits `fn()` with jittered retries, guarded by `breaker`. Raises CircuitOpenError if the circuit is open.
+    Errors for which `is_retryable` is False (e.g. a 400 for one bad request) are raised at once and
+    leave the breaker as it was: they neither count against the upstream's health nor for it.
+    """
+    last_error = None
+    for attempt in range(attempts):
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} circuit is open") from last_error
+        try:
+            result = await fn()
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.record_neutral()
+                raise
+            breaker.record_failure()
+            last_error = e
+            if attempt + 1 < attempts:
+                await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        breaker.record_success()
+        return result
+    raise last_error
+
+
+def create_llm_client(api_key: str, base_url: str, connect_timeout: float, read_timeout: float, max_connections: int) -> AsyncOpenAI:
+    """One long-lived AsyncOpenAI client with a keep-alive pool; retries are ours, not the SDK's."""
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        timeout=Timeout(read_timeout, connect=connect_timeout),
+        max_retries=0,
+    )
+
+
+def create_download_session(pool_size: int) -> requests.Session:
+    """A pooled keep-alive session for fetching synthesized audio from DashScope's result URLs."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,52 @@
+import logging
+import shutil
+import subprocess
+
+# Formats a client may ask for, with the MIME type sent alongside the binary frame.
+# "wav" is always available; the compressed formats need a local ffmpeg.
+AUDIO_MIME_TYPES = {
+    "opus": "audio/ogg; codecs=opus",
+    "mp3": "audio/mpeg",
+    "wav": "audio/wav",
+}
+
+_FFMPEG_ARGS = {
+    "opus": ["-c:a", "libopus", "-b:a", "32k", "-f", "ogg"],
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"],
+}
+
+FFMPEG_PATH = shutil.which("ffmpeg")
+ENCODE_TIMEOUT_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+
+def available_formats():
+    return ["opus", "mp3", "wav"] if FFMPEG_PATH else ["wav"]
+
+
+def choose_format(preferred) -> str:
+    """Picks the first of the client's preferred formats that can be produced here, falling back to WAV."""
+    available = available_formats()
+    for fmt in preferred or ():
+        if fmt in available: return fmt
+    return "wav"
+
+
+def encode_audio(wav_bytes: bytes, fmt: str):
+    """
+    Transcodes WAV bytes to `fmt` with ffmpeg (blocking; run it on an executor).
+    Returns (audio_bytes, format) — the original WAV and "wav" if encoding isn't possible.
+    """
+    if fmt == "wav" or fmt not in _FFMPEG_ARGS or not FFMPEG_PATH:
+        return wav_bytes, "wav"
+    try:
+        result = subprocess.run(
+            [FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", *_FFMPEG_ARGS[fmt], "pipe:1"],
+            input=wav_bytes, capture_output=True, timeout=ENCODE_TIMEOUT_SECONDS, check=True,
+        )
+        if result.stdout:
+            return result.stdout, fmt
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning("Could not encode audio as %s, falling back to WAV: %s", fmt, e)
+    return wav_bytes, "wav"
@@ -0,0 +1,118 @@
+"""
+Differential check + throughput benchmark: compiled MeaninglessFilter vs. the original
+per-pattern is_meaningless() loop.
+
+Every comment in a generated corpus must get the same verdict from both implementations
+before any timing is reported; the script exits non-zero on the first mismatch.
+
+Usage: python benchmarks/bench_meaningless_filter.py [--comments 20000] [--seed 11]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from message_filter import MeaninglessFilter
+
+FILLER = "的一是了我不人在有这个上们来到时大为你说主播好看多少钱包邮吗链接红富士苹果abcXYZhqwHQWkKſsß123!?！？。~ "
+WHITESPACE = [" ", "  ", "\t", "\n", "　"]
+
+
+def legacy_is_meaningless(message: str, ai_settings: dict) -> bool:
+    """The pre-compilation implementation, kept verbatim as the reference."""
+    filtering_enabled = ai_settings.get("filtering_enabled", False)
+    if not filtering_enabled: return False
+
+    min_length = ai_settings.get("min_message_length", 4)
+    if len(message) < min_length: return True
+    meaningless_patterns = ai_settings.get("meaningless_patterns", [])
+    for pattern in meaningless_patterns:
+        if pattern == message.strip() or (len(message.strip()) <= len(pattern) + 2 and pattern in message): return True
+        try:
+            if re.search(re.escape(pattern), message, re.IGNORECASE):
+                if len(message.strip()) / len(pattern) < 2: return True
+        except re.error: pass
+    if len(message) > 2 and len(set(message.lower())) <= 2: return True
+    return False
+
+
+def shipped_personas():
+    with open(os.path.join(ROOT, "keywords_config.json"), encoding="utf-8") as f:
+        personas = json.load(f).get("ai_settings", {}).get("personas", {})
+    return [dict(p, filtering_enabled=True) for p in personas.values() if p.get("meaningless_patterns")]
+
+
+def random_persona(rng: random.Random):
+    patterns = ["".join(rng.choice(FILLER) for _ in range(rng.randint(1, 6))) for _ in range(rng.randint(1, 80))]
+    return {"filtering_enabled": True, "min_message_length": rng.randint(0, 5), "meaningless_patterns": patterns}
+
+
+def make_corpus(n: int, patterns, rng: random.Random):
+    corpus = []
+    for _ in range(n):
+        kind = rng.random()
+        if kind < 0.3 and patterns:
+            # A pattern, possibly case-flipped, padded with whitespace and a few extra characters
+            text = rng.choice(patterns)
+            if rng.random() < 0.5: text = text.swapcase()
+            text = "".join(rng.choice(FILLER) for _ in range(rng.randint(0, 4))) + text
+            text += "".join(rng.choice(FILLER) for _ in range(rng.randint(0, 4)))
+            if rng.random() < 0.3: text = rng.choice(WHITESPACE) + text + rng.choice(WHITESPACE)
+        elif kind < 0.45:
+            # Repeated-character spam
+            text = rng.choice(FILLER) * rng.randint(1, 8) + rng.choice(FILLER) * rng.randint(0, 3)
+        else:
+            text = "".join(rng.choice(FILLER) for _ in range(rng.randint(0, 40)))
+        corpus.append(text)
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--random-personas", type=int, default=50, help="extra randomly generated personas to cross-check")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    personas = shipped_personas() + [random_persona(rng) for _ in range(args.random_personas)]
+
+    checked = 0
+    for persona in personas:
+        compiled = MeaninglessFilter.from_settings(persona)
+        corpus = make_corpus(args.comments // 10, persona["meaningless_patterns"], rng)
+        for message in corpus:
+            expected = legacy_is_meaningless(message, persona)
+            if compiled(message) != expected:
+                print(f"MISMATCH: message={message!r} expected={expected} persona={persona}")
+                sys.exit(1)
+            checked += 1
+    print(f"Differential check passed: {checked} verdicts over {len(personas)} personas.")
+
+    persona = personas[0]
+    compiled = MeaninglessFilter.from_settings(persona)
+    corpus = make_corpus(args.comments, persona["meaningless_patterns"], rng)
+
+    def timed(fn):
+        best = float("inf")
+        for _ in range(3):
+            start = time.perf_counter()
+            for message in corpus: fn(message)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    legacy = timed(lambda m: legacy_is_meaningless(m, persona))
+    fast = timed(compiled)
+    print(f"Persona with {len(persona['meaningless_patterns'])} patterns, {len(corpus)} comments:")
+    print(f"  legacy   {len(corpus) / legacy:>12,.0f} msgs/s")
+    print(f"  compiled {len(corpus) / fast:>12,.0f} msgs/s  ({legacy / fast:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""
+End-to-end load test: runs ai_backend.py against local mock DeepSeek/DashScope servers (see
+mock_upstreams.py) and replays WebcastChatMessage batch traces over WebSocket at fixed rates.
+Reports client-side time-to-first-audio p50/p95/p99, reply throughput, drops, the backend's own
+stage percentiles (via `get_metrics`) and backend memory. No network access or API keys needed.
+
+Usage: python benchmarks/load_test.py [--rates 10,100,1000,10000] [--duration 60] [--trace trace.jsonl]
+                                      [--unthrottled] [--set REPLY_BATCHING_ENABLED=True] [--output results.json]
+       python benchmarks/load_test.py --record trace.jsonl --rates 600 --duration 120
+
+A trace is JSON lines of {"t": seconds_from_start, "messages": [WebcastChatMessage, ...]}. Recorded
+traces are retimed to each requested rate and looped to fill --duration.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+import websockets
+
+from mock_upstreams import MockUpstreams
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Starts the backend with module attributes overridden, e.g. {"REPLY_SCHEDULER.replies_per_minute": 0}
+BOOTSTRAP = """
+import asyncio, json, sys
+sys.path.insert(0, sys.argv[1])
+import ai_backend
+for path, value in json.loads(sys.argv[2]).items():
+    *parents, attr = path.split(".")
+    target = ai_backend
+    for name in parents: target = getattr(target, name)
+    setattr(target, attr, value)
+asyncio.run(ai_backend.main())
+"""
+
+# Applied to every run: pre-warming would put a burst of TTS calls in front of the first comments
+DEFAULTS = {"TTS_CACHE_PREWARM": False}
+
+# Lift the reply scheduler's product limits so the run measures the pipeline, not the pacing policy
+UNTHROTTLED = {
+    "REPLY_SCHEDULER.replies_per_minute": 0,
+    "REPLY_SCHEDULER.user_cooldown_seconds": 0,
+    "REPLY_SCHEDULER.dedup_window_seconds": 0,
+}
+
+MEANINGLESS = ["666", "哈哈哈哈", "1111", "？？？", "来了来了", "👍👍👍", "主播好", "打卡"]
+SUBJECTS = ["主播", "这个", "今天的", "你们家", "刚才那个", "这款", "直播间", "老板"]
+PREDICATES = ["怎么用", "适合送人吗", "质量好不好", "有什么区别", "能便宜点吗", "几点下播", "是正品吗", "什么时候上新", "推荐哪个", "好吃吗"]
+ENDINGS = ["？", "吗", "呀", "", "啊？"]
+
+
+def percentile(sorted_values, q: float):
+    if not sorted_values: return None
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def load_keywords(config_path: str):
+    with open(config_path, encoding="utf-8") as f:
+        return [k for k in json.load(f) if k != "ai_settings"]
+
+
+def synthetic_trace(rate_per_minute: float, duration: float, keywords, rng: random.Random, batch_interval: float = 1.0,
+                    users: int = 2000, keyword_ratio: float = 0.3, meaningless_ratio: float = 0.2):
+    """Batches every `batch_interval` seconds with a Poisson number of comments averaging `rate_per_minute`."""
+    trace, per_batch = [], rate_per_minute / 60.0 * batch_interval
+    for step in range(int(duration / batch_interval)):
+        # Knuth's Poisson sampler is fine for the small means a one-second batch has
+        count, threshold, product = 0, pow(2.718281828459045, -per_batch), rng.random()
+        while product > threshold:
+            count += 1
+            product *= rng.random()
+        messages = []
+        for _ in range(count):
+            roll = rng.random()
+            if roll < meaningless_ratio:
+                content = rng.choice(MEANINGLESS)
+            elif roll < meaningless_ratio + keyword_ratio and keywords:
+                content = f"{rng.choice(SUBJECTS)}{rng.choice(keywords)}{rng.choice(ENDINGS)}"
+            else:
+                content = f"{rng.choice(SUBJECTS)}{rng.choice(PREDICATES)}{rng.choice(ENDINGS)}{rng.randint(1, 99)}"
+            uid = rng.randrange(users)
+            messages.append({"method": "WebcastChatMessage", "content": content, "user": {"id": str(uid), "name": f"观众{uid}"}})
+        if messages:
+            trace.append((step * batch_interval, messages))
+    return trace
+
+
+def save_trace(path: str, trace):
+    with open(path, "w", encoding="utf-8") as f:
+        for t, messages in trace:
+            f.write(json.dumps({"t": round(t, 3), "messages": messages}, ensure_ascii=False) + "\n")
+
+
+def load_trace(path: str):
+    with open(path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return sorted(((e["t"], e["messages"]) for e in entries), key=lambda e: e[0])
+
+
+def retime_trace(trace, rate_per_minute: float, duration: float):
+    """Stretches or compresses a recorded trace to `rate_per_minute` and repeats it to fill `duration`."""
+    total = sum(len(messages) for _, messages in trace)
+    if not total: return []
+    span = max(trace[-1][0] - trace[0][0], 1.0)
+    scale = (total / span * 60.0) / rate_per_minute
+    period = span * scale
+    retimed, offset = [], 0.0
+    while offset < duration:
+        for t, messages in trace:
+            at = offset + (t - trace[0][0]) * scale
+            if at >= duration: break
+            retimed.append((at, messages))
+        offset += period
+    return retimed
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def read_memory_kb(pid: int):
+    """(VmRSS, VmHWM) in KiB from /proc; (None, None) where that isn't available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class BackendProcess:
+    """ai_backend.py in a subprocess with its own working directory (config copy, fresh TTS cache)."""
+
+    def __init__(self, config_path: str, upstreams: MockUpstreams, overrides: dict, log_level: str = "WARNING"):
+        self.workdir = tempfile.mkdtemp(prefix="danmaku-load-")
+        shutil.copy(config_path, os.path.join(self.workdir, "keywords_config.json"))
+        self.port = free_port()
+        self.overrides = overrides
+        self.env = dict(
+            os.environ,
+            DEEPSEEK_BASE_URL=upstreams.deepseek_base_url,
+            DASHSCOPE_BASE_URL=upstreams.dashscope_base_url,
+            DEEPSEEK_API_KEY="mock-key",
+            DASH_SCOPE_API_KEY="mock-key",
+            AI_BACKEND_PORT=str(self.port),
+            METRICS_PORT="0",
+            LOG_LEVEL=log_level,
+        )
+        self.process = None
+        self.rss_samples = []
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"ws://localhost:{self.port}"
+
+    async def start(self, timeout: float = 30.0):
+        self._log = open(os.path.join(self.workdir, "backend.log"), "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", BOOTSTRAP, os.path.abspath(REPO_DIR), json.dumps(self.overrides)],
+            cwd=self.workdir, env=self.env, stdin=subprocess.DEVNULL, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Backend exited with code {self.process.returncode}; see {self._log.name}")
+            try:
+                async with websockets.connect(self.url):
+                    break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Backend did not start within {timeout}s; see {self._log.name}")
+                await asyncio.sleep(0.2)
+        self._sampler = threading.Thread(target=self._sample_memory, daemon=True)
+        self._sampler.start()
+
+    def _sample_memory(self):
+        while not self._stop_sampling.wait(0.5):
+            rss, _ = read_memory_kb(self.process.pid)
+            if rss is not None: self.rss_samples.append(rss)
+
+    def memory(self) -> dict:
+        rss, peak = read_memory_kb(self.process.pid)
+        return {
+            "rss_start_mb": round(self.rss_samples[0] / 1024, 1) if self.rss_samples else None,
+            "rss_end_mb": round(rss / 1024, 1) if rss is not None else None,
+            "rss_peak_mb": round(peak / 1024, 1) if peak is not None else None,
+        }
+
+    def stop(self, keep_workdir: bool = False):
+        self._stop_sampling.set()
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try: self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired: self.process.kill()
+        self._log.close()
+        if not keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class ReplyTracker:
+    """Matches replies back to the comments they answer (by comment text, oldest first)."""
+
+    def __init__(self):
+        self.pending = defaultdict(deque) # comment text -> send times not yet answered
+        self.latencies = []
+        self.replies = 0
+        self.sent = 0
+
+    def sent_batch(self, messages, now: float):
+        for message in messages:
+            self.pending[message["content"]].append(now)
+        self.sent += len(messages)
+
+    def received(self, message: dict, now: float):
+        if message.get("type") == "ai_response_chunk":
+            if message.get("seq") != 0 or message.get("is_final"): return
+        elif message.get("type") != "ai_response":
+            return
+        self.replies += 1
+        # Batched replies name every merged comment, joined with " / "
+        for text in (message.get("original_comment") or {}).get("text", "").split(" / "):
+            queue = self.pending.get(text)
+            if queue:
+                self.latencies.append(now - queue.popleft())
+                if not queue: del self.pending[text]
+
+
+async def listen(url: str, binary_audio: bool, counter: list):
+    """An extra viewer connection that only receives, so broadcasts fan out like in a real room."""
+    async with websockets.connect(url, max_size=None) as ws:
+        if binary_audio:
+            await ws.send(json.dumps({"action": "set_protocol", "binary_audio": True, "audio_formats": ["opus", "mp3", "wav"]}))
+        async for _ in ws:
+            counter[0] += 1
+
+
+async def replay(url: str, trace, drain_seconds: float, listeners: int, binary_audio: bool):
+    tracker, listener_frames = ReplyTracker(), [0]
+    listener_tasks = [asyncio.create_task(listen(url, binary_audio, listener_frames)) for _ in range(listeners)]
+    metrics = None
+    async with websockets.connect(url, max_size=None) as ws:
+        metrics_received = asyncio.Event()
+
+        async def receive():
+            nonlocal metrics
+            async for frame in ws:
+                if isinstance(frame, bytes): continue
+                message = json.loads(frame)
+                if message.get("type") == "metrics":
+                    metrics = message["data"]
+                    metrics_received.set()
+                else:
+                    tracker.received(message, time.monotonic())
+
+        receiver = asyncio.create_task(receive())
+        started = time.monotonic()
+        for t, messages in trace:
+            delay = started + t - time.monotonic()
+            if delay > 0: await asyncio.sleep(delay)
+            tracker.sent_batch(messages, time.monotonic())
+            await ws.send(json.dumps(messages, ensure_ascii=False))
+        sending_seconds = time.monotonic() - started
+
+        async def fetch_metrics():
+            metrics_received.clear()
+            await ws.send(json.dumps({"action": "get_metrics"}))
+            try: await asyncio.wait_for(metrics_received.wait(), timeout=10)
+            except asyncio.TimeoutError: pass
+
+        # Let queued and in-flight replies land: stop once the ingest queue is empty and two
+        # consecutive seconds bring no new reply
+        drain_deadline, idle, last_replies = time.monotonic() + drain_seconds, 0, -1
+        while time.monotonic() < drain_deadline and idle < 2:
+            await asyncio.sleep(1)
+            await fetch_metrics()
+            queue_empty = metrics is None or metrics["ingest_queue"]["depth"] == 0
+            idle = idle + 1 if queue_empty and tracker.replies == last_replies else 0
+            last_replies = tracker.replies
+        elapsed = time.monotonic() - started
+
+        await fetch_metrics()
+        receiver.cancel()
+    for task in listener_tasks: task.cancel()
+    await asyncio.gather(*listener_tasks, return_exceptions=True)
+    return tracker, metrics, sending_seconds, elapsed, listener_frames[0]
+
+
+def summarize(rate, tracker: ReplyTracker, metrics, sending_seconds: float, elapsed: float, memory: dict, listener_frames: int) -> dict:
+    latencies = sorted(tracker.latencies)
+    stages, prompt_tokens = {}, {}
+    messages, ingest, llm_tokens = {}, {}, {}
+    if metrics:
+        messages = metrics["metrics"].get("messages", {})
+        ingest = metrics.get("ingest_queue", {})
+        llm_tokens = metrics["metrics"].get("llm_tokens", {})
+        for name, values in metrics["metrics"].get("stage_duration_seconds", {}).items():
+            stages[name] = {k: values[k] for k in ("count", "p50", "p95", "p99")}
+        for part, values in metrics["metrics"].get("llm_prompt_tokens", {}).items():
+            prompt_tokens[part] = values["mean"]
+    return {
+        "rate_per_minute": rate,
+        "sent": tracker.sent,
+        "offered_per_minute": round(tracker.sent / sending_seconds * 60, 1) if sending_seconds else None,
+        "replies": tracker.replies,
+        "replies_per_minute": round(tracker.replies / elapsed * 60, 1) if elapsed else None,
+        "answered": len(latencies),
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": latencies[-1] if latencies else None,
+        "triage": messages,
+        "shed": ingest.get("dropped"),
+        "expired": ingest.get("expired"),
+        "still_queued": ingest.get("depth"),
+        "listener_frames": listener_frames,
+        "stages": stages,
+        "prompt_tokens_mean": prompt_tokens,
+        "llm_tokens": llm_tokens,
+        **memory,
+    }
+
+
+def print_report(results):
+    def fmt(value, spec=".3f"):
+        return "-" if value is None else format(value, spec)
+
+    print()
+    print(f"{'rate/min':>9} {'sent':>7} {'replies':>8} {'reply/min':>10} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'shed':>6} {'expired':>8} {'rss MB':>7} {'peak MB':>8}")
+    for r in results:
+        print(f"{r['rate_per_minute']:>9} {r['sent']:>7} {r['replies']:>8} {fmt(r['replies_per_minute'], '.1f'):>10} "
+              f"{fmt(r['latency_p50']):>7} {fmt(r['latency_p95']):>7} {fmt(r['latency_p99']):>7} "
+              f"{fmt(r['shed'], 'd'):>6} {fmt(r['expired'], 'd'):>8} {fmt(r['rss_end_mb'], '.1f'):>7} {fmt(r['rss_peak_mb'], '.1f'):>8}")
+    for r in results:
+        print(f"\n[{r['rate_per_minute']}/min] triage: {json.dumps(r['triage'], ensure_ascii=False)}, still queued at end: {fmt(r['still_queued'], 'd')}")
+        if r["prompt_tokens_mean"]:
+            parts = " ".join(f"{part}={fmt(mean, '.0f')}" for part, mean in r["prompt_tokens_mean"].items())
+            print(f"    prompt tokens per request (estimated mean): {parts}; reported by upstream: {json.dumps(r['llm_tokens'])}")
+        for stage, values in r["stages"].items():
+            p50, p95, p99 = (None if values[q] is None else values[q] * 1000 for q in ("p50", "p95", "p99"))
+            print(f"    {stage:<16} n={values['count']:<6} p50={fmt(p50, '.2f')}ms p95={fmt(p95, '.2f')}ms p99={fmt(p99, '.2f')}ms")
+
+
+def parse_overrides(assignments):
+    overrides = {}
+    for assignment in assignments or ():
+        path, _, raw = assignment.partition("=")
+        try: overrides[path.strip()] = ast.literal_eval(raw)
+        except (ValueError, SyntaxError): overrides[path.strip()] = raw
+    return overrides
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    keywords = load_keywords(args.config)
+    rates = [float(r) if "." in r else int(r) for r in args.rates.split(",")]
+    recorded = load_trace(args.trace) if args.trace else None
+
+    overrides = dict(DEFAULTS, **(UNTHROTTLED if args.unthrottled else {}))
+    overrides.update(parse_overrides(args.set))
+
+    upstreams = MockUpstreams(llm_latency=args.llm_latency, tts_latency=args.tts_latency, jitter=args.jitter,
+                              token_interval=args.token_interval, error_rate=args.error_rate, seed=args.seed).start()
+    results = []
+    try:
+        for rate in rates:
+            trace = retime_trace(recorded, rate, args.duration) if recorded else synthetic_trace(rate, args.duration, keywords, rng)
+            backend = BackendProcess(args.config, upstreams, overrides)
+            await backend.start()
+            print(f"[load_test] {rate} msgs/min for {args.duration}s ({sum(len(m) for _, m in trace)} comments) -> {backend.url}")
+            try:
+                tracker, metrics, sending_seconds, elapsed, listener_frames = await replay(
+                    backend.url, trace, args.drain, args.listeners, args.binary_audio)
+                results.append(summarize(rate, tracker, metrics, sending_seconds, elapsed, backend.memory(), listener_frames))
+            finally:
+                backend.stop(args.keep_workdir)
+                if args.keep_workdir: print(f"[load_test] Backend workdir kept at {backend.workdir}")
+    finally:
+        upstreams.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "overrides": overrides, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n[load_test] Results written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rates", default="10,100,1000,10000", help="Comma-separated comment rates (per minute), one backend run each")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of traffic per rate")
+    parser.add_argument("--drain", type=float, default=35, help="Max seconds to wait for replies after the last comment")
+    parser.add_argument("--trace", help="Replay this JSONL trace (retimed to each rate) instead of synthetic traffic")
+    parser.add_argument("--record", help="Write the synthetic trace for the first rate to this file and exit")
+    parser.add_argument("--config", default=os.path.join(REPO_DIR, "keywords_config.json"), help="keywords_config.json to run the backend with")
+    parser.add_argument("--unthrottled", action="store_true", help="Disable the reply budget, per-user cooldown and dedup")
+    parser.add_argument("--set", action="append", metavar="NAME=VALUE", help="Override a backend attribute, e.g. STREAMING_MODE=True")
+    parser.add_argument("--listeners", type=int, default=2, help="Extra receive-only clients")
+    parser.add_argument("--binary-audio", action="store_true", help="Listeners negotiate binary audio frames")
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--tts-latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--token-interval", type=float, default=0.03)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep each run's backend log and TTS cache")
+    parser.add_argument("--output", help="Also write the results as JSON (for comparing runs)")
+    args = parser.parse_args()
+
+    if args.record:
+        rate = float(args.rates.split(",")[0])
+        trace = synthetic_trace(rate, args.duration, load_keywords(args.config), random.Random(args.seed))
+        save_trace(args.record, trace)
+        print(f"[load_test] Wrote {sum(len(m) for _, m in trace)} comments in {len(trace)} batches to {args.record}")
+        return
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Local stand-ins for the DeepSeek chat API and the DashScope Qwen-TTS API, for load tests without
+network access or API keys. Point the backend at them with DEEPSEEK_BASE_URL / DASHSCOPE_BASE_URL.
+
+    python benchmarks/mock_upstreams.py --llm-latency 0.8 --tts-latency 0.5 --jitter 0.3
+
+- POST .../chat/completions answers with "[happy]<canned reply>", as JSON or as an SSE stream
+  (time to first token = latency, then `--token-interval` between deltas).
+- POST .../generation (what MultiModalConversation.call hits) returns an audio URL on this server.
+- GET /audio/<id>.wav serves a short silent WAV.
+Every request may also fail with a 500 at `--error-rate`.
+"""
+import argparse
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_USER_QUESTION_RE = re.compile(r"用户说：'(.*)'。", re.DOTALL)
+
+
+def make_silent_wav(seconds: float = 0.5, sampling_rate: int = 24000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sampling_rate)
+        wf.writeframes(b"\x00\x00" * int(seconds * sampling_rate))
+    return buffer.getvalue()
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass # Clients (the backend under test) routinely hang up mid-request when a run ends
+
+
+class MockUpstreams:
+    """Both mock APIs on one threaded HTTP server; each request sleeps in its own thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, llm_latency: float = 0.8, tts_latency: float = 0.5,
+                 jitter: float = 0.3, token_interval: float = 0.03, error_rate: float = 0.0, seed: int = None):
+        self.llm_latency = llm_latency
+        self.tts_latency = tts_latency
+        self.jitter = jitter
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.wav_bytes = make_silent_wav()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._audio_ids = itertools.count(1)
+        self.counts = {"llm": 0, "tts": 0, "audio": 0, "errors": 0}
+
+        upstreams = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real APIs
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                upstreams._handle_post(self, json.loads(body or b"{}"))
+
+            def do_GET(self):
+                upstreams._handle_get(self)
+
+        self._server = _QuietHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def deepseek_base_url(self) -> str:
+        return self.base_url + "/v1"
+
+    @property
+    def dashscope_base_url(self) -> str:
+        return self.base_url + "/api/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-upstreams", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _delay(self, base: float) -> float:
+        with self._random_lock:
+            return max(0.0, base + self._random.uniform(-self.jitter, self.jitter) * base)
+
+    def _fails(self) -> bool:
+        with self._random_lock:
+            failed = self._random.random() < self.error_rate
+        if failed: self.counts["errors"] += 1
+        return failed
+
+    @staticmethod
+    def _send(handler, status: int, content_type: str, body: bytes):
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _send_json(self, handler, payload: dict, status: int = 200):
+        self._send(handler, status, "application/json", json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    def _handle_post(self, handler, payload: dict):
+        if handler.path.endswith("/chat/completions"):
+            self.counts["llm"] += 1
+            self._chat_completion(handler, payload)
+        elif handler.path.endswith("/generation"):
+            self.counts["tts"] += 1
+            time.sleep(self._delay(self.tts_latency))
+            if self._fails():
+                self._send_json(handler, {"code": "InternalError", "message": "mock failure"}, 500)
+                return
+            audio_id = next(self._audio_ids)
+            self._send_json(handler, {
+                "request_id": f"mock-{audio_id}",
+                "output": {"finish_reason": "stop", "audio": {"id": f"audio-{audio_id}", "url": f"{self.base_url}/audio/{audio_id}.wav", "expires_at": 0}},
+                "usage": {"characters": len(payload.get("input", {}).get("text", ""))},
+            })
+        else:
+            self._send_json(handler, {"error": "not found"}, 404)
+
+    def _handle_get(self, handler):
+        if handler.path.startswith("/audio/"):
+            self.counts["audio"] += 1
+            self._send(handler, 200, "audio/wav", self.wav_bytes)
+        else:
+            self._send_json(handler, {"error": "not found"}, 404)
+
+    def _chat_completion(self, handler, payload: dict):
+        time.sleep(self._delay(self.llm_latency))
+        if self._fails():
+            self._send_json(handler, {"error": {"message": "mock failure", "type": "server_error"}}, 500)
+            return
+        user_message = next((m["content"] for m in reversed(payload.get("messages", [])) if m.get("role") == "user"), "")
+        match = _USER_QUESTION_RE.search(user_message)
+        question = match.group(1) if match else user_message[:20]
+        reply = f"[happy]收到你的问题：{question}。这是一条模拟回复，感谢支持！"
+        created = int(time.time())
+        # One token per character: crude, but it moves with prompt size the way real usage does
+        prompt_tokens = sum(len(m.get("content") or "") for m in payload.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(reply), "total_tokens": prompt_tokens + len(reply)}
+
+        if not payload.get("stream"):
+            self._send_json(handler, {
+                "id": "mock-chat", "object": "chat.completion", "created": created, "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}],
+                "usage": usage,
+            })
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close") # No Content-Length: the stream ends when we close
+        handler.end_headers()
+        handler.close_connection = True
+        deltas = [reply[i:i + 4] for i in range(0, len(reply), 4)]
+        for i, delta in enumerate(deltas):
+            chunk = {
+                "id": "mock-chat", "object": "chat.completion.chunk", "created": created, "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": "stop" if i == len(deltas) - 1 else None}],
+            }
+            handler.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            handler.wfile.flush()
+            if self.token_interval: time.sleep(self.token_interval)
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            chunk = {"id": "mock-chat", "object": "chat.completion.chunk", "created": created, "model": payload.get("model", "mock"), "choices": [], "usage": usage}
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Seconds until the first token / full reply")
+    parser.add_argument("--tts-latency", type=float, default=0.5, help="Seconds per synthesis call")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Relative +/- jitter applied to both latencies")
+    parser.add_argument("--token-interval", type=float, default=0.03, help="Seconds between streamed deltas")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    args = parser.parse_args()
+
+    upstreams = MockUpstreams(args.host, args.port, args.llm_latency, args.tts_latency, args.jitter, args.token_interval, args.error_rate).start()
+    print(f"DEEPSEEK_BASE_URL={upstreams.deepseek_base_url}")
+    print(f"DASHSCOPE_BASE_URL={upstreams.dashscope_base_url}")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        upstreams.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+# Overflow policies for a full per-client send queue
+DROP_OLDEST = "drop_oldest"  # Discard the oldest queued message to make room
+DROP_NEWEST = "drop_newest"  # Discard the incoming message
+COALESCE = "coalesce"  # Replace a queued message with the same coalesce key, else drop oldest
+
+logger = logging.getLogger(__name__)
+
+
+def frames_size(frames) -> int:
+    """Bytes a message's frames take on the wire (text frames as UTF-8). Compute it once per broadcast, not per client."""
+    return sum(len(frame.encode("utf-8")) if isinstance(frame, str) else len(frame) for frame in frames)
+
+
+class ClientSession:
+    """
+    One connected WebSocket client with its own bounded outbound queue and writer task.
+
+    Broadcasts only enqueue, so a stalled browser tab backs up its own queue instead of every
+    other client's. A message is a list of frames (e.g. JSON metadata + binary audio) that the
+    writer sends back to back. Clients that keep overflowing or fall too far behind are evicted.
+    """
+
+    def __init__(self, websocket, max_queue: int = 32, overflow_policy: str = DROP_OLDEST,
+                 evict_after_drops: int = 16, evict_lag_seconds: float = 20.0):
+        if overflow_policy not in (DROP_OLDEST, DROP_NEWEST, COALESCE):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.evict_after_drops = evict_after_drops
+        self.evict_lag_seconds = evict_lag_seconds
+
+        self.room_id = None # Room whose broadcasts this client receives
+
+        # Negotiated protocol options (see the `set_protocol` action)
+        self.binary_audio = False # Metadata as a JSON frame, audio as the binary frame right after it
+        self.audio_format = "wav"
+
+        self._queue = deque() # [enqueued_at, frames, coalesce_key, size in bytes]
+        self._wakeup = asyncio.Event()
+        self._sending_since = None # enqueued_at of the message currently being written
+        self._writer_task = None
+        self._close_task = None
+        self.evicted = False
+
+        self.sent = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.consecutive_drops = 0 # Drops since the writer last managed to send something
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def remote_address(self):
+        return self.websocket.remote_address
+
+    def start(self):
+        self._writer_task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        if self._writer_task:
+            self._writer_task.cancel()
+            try: await self._writer_task
+            except asyncio.CancelledError: pass
+            self._writer_task = None
+
+    def lag(self) -> float:
+        """Age of the oldest message not yet fully written to this client."""
+        oldest = self._sending_since if self._sending_since is not None else (self._queue[0][0] if self._queue else None)
+        return time.monotonic() - oldest if oldest is not None else 0.0
+
+    def enqueue(self, frames, coalesce_key=None, size=None) -> bool:
+        """
+        Queues a message without waiting. Returns False if the message itself was dropped.
+        `size` is `frames_size(frames)`, passed in when the same frames go to many clients.
+        """
+        if self.evicted: return False
+        now = time.monotonic()
+        if size is None: size = frames_size(frames)
+
+        if self.overflow_policy == COALESCE and coalesce_key is not None:
+            for entry in self._queue:
+                if entry[2] == coalesce_key:
+                    entry[0], entry[1], entry[3] = now, frames, size
+                    self.coalesced += 1
+                    return True
+
+        accepted = True
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            self.consecutive_drops += 1
+            if self.overflow_policy == DROP_NEWEST:
+                accepted = False
+            else:
+                self._queue.popleft()
+
+        if accepted:
+            self._queue.append([now, frames, coalesce_key, size])
+            self._wakeup.set()
+        self._check_eviction()
+        return accepted
+
+    def _check_eviction(self):
+        reason = None
+        if self.evict_after_drops and self.consecutive_drops >= self.evict_after_drops:
+            reason = f"{self.consecutive_drops} messages dropped without progress"
+        elif self.evict_lag_seconds and self.lag() > self.evict_lag_seconds:
+            reason = f"{self.lag():.1f}s behind"
+        if reason:
+            self.evict(reason)
+
+    def evict(self, reason: str):
+        if self.evicted: return
+        self.evicted = True
+        self._queue.clear()
+        logger.warning("Evicting slow client %s: %s", self.remote_address, reason)
+        # 1013 = "try again later"; the handler's finally block does the bookkeeping once the socket closes
+        self._close_task = asyncio.create_task(self.websocket.close(code=1013, reason="Slow consumer"))
+
+    async def _writer(self):
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            enqueued_at, frames, _, size = self._queue.popleft()
+            self._sending_since = enqueued_at
+            try:
+                for frame in frames:
+                    await self.websocket.send(frame)
+            except Exception as e:
+                logger.info("Error sending to client %s: %s. Client will be removed.", self.remote_address, e)
+                self.evict("send failed")
+                return
+            finally:
+                self._sending_since = None
+            self.sent += 1
+            self.bytes_sent += size
+            self.consecutive_drops = 0
+            self.last_lag = time.monotonic() - enqueued_at
+            self.max_lag = max(self.max_lag, self.last_lag)
+            if self.evict_lag_seconds and self.last_lag > self.evict_lag_seconds:
+                self.evict(f"{self.last_lag:.1f}s behind")
+                return
+
+    def stats(self) -> dict:
+        return {
+            "remote_address": str(self.remote_address),
+            "room_id": self.room_id,
+            "binary_audio": self.binary_audio,
+            "audio_format": self.audio_format,
+            "queue_depth": len(self._queue),
+            "lag_seconds": round(self.lag(), 3),
+            "last_lag_seconds": round(self.last_lag, 3),
+            "max_lag_seconds": round(self.max_lag, 3),
+            "sent": self.sent,
+            "bytes_sent": self.bytes_sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,203 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from keyword_matcher import KeywordMatcher
+from message_filter import MeaninglessFilter
+
+DEFAULT_PERSONA_PROMPT = "你是一个直播间助手，你的名字叫“弹幕鸭”。请用友好、简洁、幽默的风格回答问题。"
+
+# Used when the active persona id doesn't exist
+FALLBACK_PERSONA = {
+    "name": "默认助手",
+    "response_mode": "keyword",
+    "persona_prompt": DEFAULT_PERSONA_PROMPT,
+    "filtering_enabled": False,
+    "min_message_length": 1,
+    "meaningless_patterns": [],
+}
+
+# Written out when no config file exists yet
+DEFAULT_CONFIG = {
+    "ai_settings": {
+        "current_persona": "live_selling_assistant",
+        "personas": {
+            "live_selling_assistant": {
+                "name": "卖货助手",
+                "response_mode": "keyword",
+                "persona_prompt": "你是一个专业的直播带货助手，名字叫弹幕鸭。你的任务是积极、热情地回答用户关于商品的所有问题，引导他们下单，并主动介绍商品亮点和优惠活动。你的语气要充满活力和说服力。",
+                "filtering_enabled": True,
+                "min_message_length": 4,
+                "meaningless_patterns": []
+            }
+        }
+    }
+}
+
+_FILTER_SETTINGS = ("filtering_enabled", "min_message_length", "meaningless_patterns")
+
+
+def config_fingerprint(full_config: dict) -> str:
+    return hashlib.sha1(json.dumps(full_config, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ConfigSnapshot:
+    """
+    One immutable, fully derived view of keywords_config.json.
+
+    Holds the raw document, the keyword table, the active persona's settings and the matcher and
+    filter compiled from them. Snapshots are never modified after construction (treat the dicts as
+    read-only); a change builds a new snapshot and the backend swaps its single reference to it, so
+    a coroutine that grabbed a snapshot keeps a consistent view for as long as it holds it.
+    """
+
+    __slots__ = ("full_config", "keywords", "ai_settings", "keyword_matcher", "meaningless_filter", "fingerprint", "version", "built_at")
+
+    def __init__(self, full_config: dict, version: int = 0, previous: "ConfigSnapshot" = None):
+        if not isinstance(full_config, dict):
+            raise ValueError("Config must be a JSON object")
+        global_ai_settings = full_config.get("ai_settings", {})
+        if not isinstance(global_ai_settings, dict):
+            raise ValueError("ai_settings must be an object")
+        keywords = {k: v for k, v in full_config.items() if k != "ai_settings"}
+        for keyword, cfg in keywords.items():
+            if not isinstance(cfg, dict):
+                raise ValueError(f"Keyword {keyword!r} must map to an object")
+
+        current_persona_id = global_ai_settings.get("current_persona", "default_persona")
+        personas = global_ai_settings.get("personas", {})
+        if not isinstance(personas, dict) or not all(isinstance(p, dict) for p in personas.values()):
+            raise ValueError("ai_settings.personas must be an object of persona objects")
+        active_persona = personas.get(current_persona_id, FALLBACK_PERSONA)
+        ai_settings = {
+            "current_persona_id": current_persona_id,
+            "current_persona_name": active_persona.get("name", "未知助手"),
+            "response_mode": active_persona.get("response_mode", "keyword"),
+            "persona_prompt": active_persona.get("persona_prompt", DEFAULT_PERSONA_PROMPT),
+            "filtering_enabled": active_persona.get("filtering_enabled", False),
+            "min_message_length": active_persona.get("min_message_length", 1),
+            "meaningless_patterns": active_persona.get("meaningless_patterns", []),
+            "all_personas": personas, # Keep all personas for frontend config
+        }
+
+        # Incremental rebuild: reuse the compiled matcher / filter when their inputs didn't change
+        if previous is not None and list(previous.keywords) == list(keywords): # Same keywords, same order
+            keyword_matcher = previous.keyword_matcher
+        else:
+            keyword_matcher = KeywordMatcher(keywords.keys())
+        if previous is not None and all(previous.ai_settings.get(k) == ai_settings[k] for k in _FILTER_SETTINGS):
+            meaningless_filter = previous.meaningless_filter
+        else:
+            meaningless_filter = MeaninglessFilter.from_settings(ai_settings)
+
+        self.full_config = full_config
+        self.keywords = keywords
+        self.ai_settings = ai_settings
+        self.keyword_matcher = keyword_matcher
+        self.meaningless_filter = meaningless_filter
+        self.fingerprint = config_fingerprint(full_config)
+        self.version = version
+        self.built_at = time.time()
+
+    def response_templates(self):
+        return list(dict.fromkeys(
+            cfg["response_template"] for cfg in self.keywords.values()
+            if isinstance(cfg, dict) and cfg.get("response_template")
+        ))
+
+
+def apply_config_patch(full_config: dict, op: dict) -> dict:
+    """
+    Returns a new config document with one edit applied; `full_config` is left untouched.
+
+        {"op": "set_keyword", "keyword": "包邮", "value": {...}}
+        {"op": "delete_keyword", "keyword": "包邮"}
+        {"op": "set_persona", "persona_id": "seller", "value": {...}}
+        {"op": "delete_persona", "persona_id": "seller"}
+        {"op": "set_current_persona", "persona_id": "seller"}
+
+    Raises ValueError for an unknown or malformed edit.
+    """
+    if not isinstance(op, dict):
+        raise ValueError(f"A config patch op must be an object, got {type(op).__name__}")
+    kind = op.get("op")
+    new_config = dict(full_config) # Shallow: untouched keywords are shared with the old document
+    if kind in ("set_keyword", "delete_keyword"):
+        keyword = op.get("keyword")
+        if not isinstance(keyword, str) or keyword == "ai_settings":
+            raise ValueError(f"Invalid keyword: {keyword!r}")
+        if kind == "set_keyword":
+            if not isinstance(op.get("value"), dict):
+                raise ValueError("set_keyword needs an object `value`")
+            new_config[keyword] = copy.deepcopy(op["value"])
+        elif keyword in new_config:
+            del new_config[keyword]
+        else:
+            raise ValueError(f"No such keyword: {keyword!r}")
+        return new_config
+
+    if kind in ("set_persona", "delete_persona", "set_current_persona"):
+        persona_id = op.get("persona_id")
+        if not isinstance(persona_id, str) or not persona_id:
+            raise ValueError(f"Invalid persona id: {persona_id!r}")
+        ai_settings = dict(new_config.get("ai_settings", {}))
+        personas = dict(ai_settings.get("personas", {}))
+        if kind == "set_persona":
+            if not isinstance(op.get("value"), dict):
+                raise ValueError("set_persona needs an object `value`")
+            personas[persona_id] = copy.deepcopy(op["value"])
+        elif kind == "delete_persona":
+            if persona_id == ai_settings.get("current_persona"):
+                raise ValueError("Cannot delete the active persona")
+            if persona_id not in personas:
+                raise ValueError(f"No such persona: {persona_id!r}")
+            del personas[persona_id]
+        else:
+            if persona_id not in personas:
+                raise ValueError(f"No such persona: {persona_id!r}")
+            ai_settings["current_persona"] = persona_id
+        ai_settings["personas"] = personas
+        new_config["ai_settings"] = ai_settings
+        return new_config
+
+    raise ValueError(f"Unknown config patch op: {kind!r}")
+
+
+def read_config_file(path: str):
+    """Returns (document, file signature). Blocking; run it off the event loop."""
+    with open(path, "r", encoding="utf-8") as f:
+        signature = file_signature(f.fileno())
+        return json.load(f), signature
+
+
+def write_config_file(path: str, data: dict):
+    """
+    Writes `data` atomically: a temp file in the same directory is fsynced and renamed over the
+    target, so readers (and the file watcher) never see a half-written config. Returns the new
+    file signature. Blocking; run it off the event loop.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".keywords_config.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+    return file_signature(path)
+
+
+def file_signature(path_or_fd):
+    """(mtime_ns, size, inode) — changes whenever the file is rewritten or replaced; None if missing."""
+    try:
+        st = os.stat(path_or_fd)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
@@ -0,0 +1,130 @@
+import math
+import time
+from collections import OrderedDict, deque
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough DeepSeek token count without a tokenizer: about 0.6 tokens per CJK character and 0.3
+    per other character. Good enough for budgeting and metrics; the API's usage report is exact.
+    """
+    cjk = sum(1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uf900" <= ch <= "\ufaff" or "\uff00" <= ch <= "\uffef")
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+class _UserTurns:
+    __slots__ = ("turns", "last_active", "chars")
+
+    def __init__(self, max_turns: int):
+        self.turns = deque(maxlen=max_turns) # (question, answer, tokens); the oldest falls off when full
+        self.last_active = 0.0
+        self.chars = 0
+
+
+class ConversationMemory:
+    """
+    The last few question/answer turns per viewer, so a follow-up question reaches the LLM with
+    its context instead of on its own.
+
+    - Each viewer has a ring buffer of `max_turns` turns; `history()` returns the newest turns
+      that fit in `max_history_tokens`, oldest first.
+    - Viewers idle for `idle_seconds` are forgotten, and beyond `max_users` viewers (or
+      `max_total_chars` of stored text) the least recently active ones are evicted.
+
+    Keys are whatever the caller uses to identify a viewer (the backend uses (room_id, user_key)).
+    Not thread-safe; used from the event loop only.
+    """
+
+    def __init__(self, max_turns: int = 3, max_history_tokens: int = 200, max_users: int = 5000,
+                 idle_seconds: float = 600.0, max_total_chars: int = 2_000_000):
+        if max_turns < 1:
+            raise ValueError(f"max_turns must be at least 1, got {max_turns}")
+        self.max_turns = max_turns
+        self.max_history_tokens = max_history_tokens
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        self.max_total_chars = max_total_chars
+        self._users = OrderedDict() # key -> _UserTurns, least recently active first
+        self._total_chars = 0
+
+        self.lookups = 0
+        self.lookups_with_history = 0
+        self.turns_trimmed = 0 # Stored turns left out of a request to stay within the token budget
+        self.evictions = {"idle": 0, "max_users": 0, "max_chars": 0}
+
+    def __len__(self):
+        return len(self._users)
+
+    def _drop(self, key, reason: str):
+        user = self._users.pop(key)
+        self._total_chars -= user.chars
+        self.evictions[reason] += 1
+
+    def _expire(self, now: float):
+        while self._users:
+            key, user = next(iter(self._users.items()))
+            if now - user.last_active <= self.idle_seconds: break
+            self._drop(key, "idle")
+
+    def history(self, key):
+        """[(question, answer), ...] for `key`, oldest first, trimmed to the token budget."""
+        self.lookups += 1
+        self._expire(time.monotonic())
+        user = self._users.get(key)
+        if user is None or not user.turns: return []
+
+        selected, budget = [], self.max_history_tokens
+        for question, answer, tokens in reversed(user.turns):
+            if tokens > budget: break
+            selected.append((question, answer))
+            budget -= tokens
+        self.turns_trimmed += len(user.turns) - len(selected)
+        if selected: self.lookups_with_history += 1
+        return selected[::-1]
+
+    def record(self, key, question: str, answer: str):
+        now = time.monotonic()
+        self._expire(now)
+        user = self._users.get(key)
+        if user is None:
+            user = self._users[key] = _UserTurns(self.max_turns)
+        if len(user.turns) == user.turns.maxlen:
+            oldest_question, oldest_answer, _ = user.turns[0]
+            user.chars -= len(oldest_question) + len(oldest_answer)
+            self._total_chars -= len(oldest_question) + len(oldest_answer)
+        user.turns.append((question, answer, estimate_tokens(question) + estimate_tokens(answer)))
+        user.chars += len(question) + len(answer)
+        self._total_chars += len(question) + len(answer)
+        user.last_active = now
+        self._users.move_to_end(key)
+
+        while len(self._users) > self.max_users:
+            self._drop(next(iter(self._users)), "max_users")
+        while self._total_chars > self.max_total_chars and len(self._users) > 1:
+            self._drop(next(iter(self._users)), "max_chars")
+
+    def forget(self, key):
+        if key in self._users:
+            user = self._users.pop(key)
+            self._total_chars -= user.chars
+
+    def forget_where(self, predicate):
+        """Forgets every viewer whose key satisfies `predicate(key)`, e.g. all viewers of one room."""
+        for key in [key for key in self._users if predicate(key)]:
+            self.forget(key)
+
+    def clear(self):
+        self._users.clear()
+        self._total_chars = 0
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "turns": sum(len(u.turns) for u in self._users.values()),
+            "chars": self._total_chars,
+            "max_users": self.max_users,
+            "lookups": self.lookups,
+            "lookups_with_history": self.lookups_with_history,
+            "turns_trimmed": self.turns_trimmed,
+            "evictions": dict(self.evictions),
+        }
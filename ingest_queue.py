@@ -0,0 +1,145 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+# Drop policies used when the queue is full
+DROP_OLDEST = "drop_oldest"  # Evict the item that has waited longest, regardless of priority
+DROP_LOWEST = "drop_lowest"  # Evict the lowest-priority item (oldest first among equals)
+
+
+class IngestQueue:
+    """
+    Bounded priority queue sitting between the WebSocket handler and the LLM/TTS workers.
+
+    Higher `priority` values are served first; items of equal priority are served in
+    arrival order. When the queue is full an item is shed according to `drop_policy`,
+    and items older than `max_age_seconds` are discarded instead of being handed to a
+    worker, so replies never go out minutes after the comment scrolled past.
+    `on_discard(item)` is called for every item shed or expired this way.
+    """
+
+    def __init__(self, capacity: int = 200, drop_policy: str = DROP_LOWEST, max_age_seconds: float = 30.0, on_discard=None):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if drop_policy not in (DROP_OLDEST, DROP_LOWEST):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.capacity = capacity
+        self.drop_policy = drop_policy
+        self.max_age_seconds = max_age_seconds
+        self.on_discard = on_discard
+
+        # Heap entries: [-priority, seq, enqueued_at, item]
+        self._heap = []
+        self._seq = itertools.count()
+        self._not_empty = asyncio.Event()
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.expired = 0
+        self.processed = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _is_stale(self, enqueued_at: float, now: float) -> bool:
+        return self.max_age_seconds is not None and now - enqueued_at > self.max_age_seconds
+
+    def _discard(self, item):
+        if self.on_discard is not None:
+            self.on_discard(item)
+
+    def _purge_expired(self, now: float):
+        fresh, stale = [], []
+        for entry in self._heap:
+            (stale if self._is_stale(entry[2], now) else fresh).append(entry)
+        if stale:
+            self.expired += len(stale)
+            heapq.heapify(fresh)
+            self._heap = fresh
+            for entry in stale: self._discard(entry[3])
+
+    def _victim_index(self) -> int:
+        if self.drop_policy == DROP_OLDEST:
+            return min(range(len(self._heap)), key=lambda i: self._heap[i][1])
+        # Lowest priority is the largest negated priority; break ties by oldest seq
+        return max(range(len(self._heap)), key=lambda i: (self._heap[i][0], -self._heap[i][1]))
+
+    def put(self, item, priority: int = 0) -> bool:
+        """
+        Enqueues `item`. Returns False if the item itself was shed because the queue is full
+        and everything already queued outranks it.
+        """
+        now = time.monotonic()
+        entry = [-priority, next(self._seq), now, item]
+
+        if len(self._heap) >= self.capacity:
+            self._purge_expired(now)
+        if len(self._heap) >= self.capacity:
+            victim = self._victim_index()
+            if self.drop_policy == DROP_LOWEST and self._heap[victim][0] < entry[0]:
+                # The incoming item is lower priority than anything queued: shed it instead
+                self.dropped += 1
+                self._discard(item)
+                return False
+            victim_item = self._heap[victim][3]
+            self._heap[victim] = self._heap[-1]
+            self._heap.pop()
+            heapq.heapify(self._heap)
+            self.dropped += 1
+            self._discard(victim_item)
+
+        heapq.heappush(self._heap, entry)
+        self.enqueued += 1
+        self._not_empty.set()
+        return True
+
+    async def get(self):
+        """Waits for the next fresh item, discarding (and counting) any that went stale while queued."""
+        while True:
+            while not self._heap:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+            item = self.get_nowait()
+            if item is not None:
+                return item
+
+    def get_nowait(self, match=None):
+        """
+        Returns the next fresh item, or None if nothing fresh is queued. With `match`, returns the
+        best fresh item for which `match(item)` is true and leaves the others where they are.
+        """
+        if match is not None:
+            return self._take_matching(match)
+        while self._heap:
+            _, _, enqueued_at, item = heapq.heappop(self._heap)
+            if self._is_stale(enqueued_at, time.monotonic()):
+                self.expired += 1
+                self._discard(item)
+                continue
+            return item
+        return None
+
+    def _take_matching(self, match):
+        self._purge_expired(time.monotonic())
+        candidates = [i for i, entry in enumerate(self._heap) if match(entry[3])]
+        if not candidates: return None
+        best = min(candidates, key=lambda i: self._heap[i][:2])
+        item = self._heap[best][3]
+        self._heap[best] = self._heap[-1]
+        self._heap.pop()
+        heapq.heapify(self._heap)
+        return item
+
+    def mark_processed(self):
+        self.processed += 1
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self._heap),
+            "capacity": self.capacity,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "processed": self.processed,
+        }
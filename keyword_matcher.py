@@ -0,0 +1,103 @@
+from collections import deque
+
+# Below this many keywords a plain `kw in text` scan (C-level substring search) beats the
+# pure-Python automaton walk, so the matcher uses it for the default semantics.
+SCAN_THRESHOLD = 48
+
+
+class KeywordMatcher:
+    """
+    Multi-pattern keyword matcher backed by an Aho–Corasick automaton.
+
+    Built once per config load; matching a comment is a single pass over its characters
+    regardless of how many keywords are configured. Matching is case-sensitive, like the
+    `kw in content` check it replaces, and results come back in keyword (config) order.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keywords)) # De-duplicate, keep config order
+        # Empty keywords match everything (`"" in content` is always True)
+        self._always = [i for i, kw in enumerate(self.keywords) if kw == ""]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()] # Keyword indices ending at each state, including those reached via fail links
+        self._build()
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def _build(self):
+        goto, out = self._goto, [[]]
+        for index, kw in enumerate(self.keywords):
+            if not kw: continue
+            state = 0
+            for ch in kw:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(index)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt].extend(out[fail[nxt]])
+
+        self._fail = fail
+        self._out = [tuple(o) for o in out]
+
+    def find_all(self, text: str):
+        """Returns every occurrence as (start, end, keyword_index), ordered by end position."""
+        goto, fail, out = self._goto, self._fail, self._out
+        hits = []
+        state = 0
+        for pos, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                end = pos + 1
+                for index in out[state]:
+                    hits.append((end - len(self.keywords[index]), end, index))
+        return hits
+
+    def match(self, text: str, longest_only: bool = False, suppress_overlaps: bool = False):
+        """
+        Returns the keywords found in `text`, in config order.
+
+        longest_only: drop occurrences that lie entirely inside a longer matched keyword
+            (e.g. "富士" inside "红富士").
+        suppress_overlaps: keep a non-overlapping, leftmost-longest set of occurrences.
+        """
+        if not longest_only and not suppress_overlaps:
+            if len(self.keywords) < SCAN_THRESHOLD:
+                return [kw for kw in self.keywords if kw in text]
+            found = set(self._always)
+            for _, _, index in self.find_all(text):
+                found.add(index)
+            return [self.keywords[i] for i in sorted(found)]
+
+        hits = self.find_all(text)
+        if longest_only:
+            hits = [h for h in hits if not any(
+                o[0] <= h[0] and h[1] <= o[1] and (o[1] - o[0]) > (h[1] - h[0]) for o in hits
+            )]
+        if suppress_overlaps:
+            kept, last_end = [], 0
+            for h in sorted(hits, key=lambda h: (h[0], h[0] - h[1])):
+                if h[0] >= last_end:
+                    kept.append(h)
+                    last_end = h[1]
+            hits = kept
+        found = set(self._always) | {index for _, _, index in hits}
+        return [self.keywords[i] for i in sorted(found)]
@@ -0,0 +1,120 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Attributes every LogRecord has; anything else on a record came in through `extra=` and is a structured field
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def record_fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS}
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `burst` records per `interval` seconds through for each call site, keyed on the
+    logger, level and *unformatted* message template — so log with `%s` arguments, not f-strings.
+    The first record let through after a quiet spell carries `suppressed=<n>` for what was dropped.
+    Records at or above `exempt_level` are never limited.
+    """
+
+    def __init__(self, burst: int = 10, interval: float = 60.0, exempt_level: int = logging.CRITICAL, max_keys: int = 2048):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.exempt_level = exempt_level
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._windows = OrderedDict() # key -> [window_start, emitted, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.burst or record.levelno >= self.exempt_level:
+            return True
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else repr(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = [now, 0, 0]
+                while len(self._windows) > self.max_keys:
+                    self._windows.popitem(last=False)
+            self._windows.move_to_end(key)
+            if now - window[0] >= self.interval:
+                window[0], window[1] = now, 0
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            if window[2]:
+                record.suppressed, window[2] = window[2], 0
+        return True
+
+
+class LogfmtFormatter(logging.Formatter):
+    """`ts=... level=... logger=... msg="..." key=value` lines, easy to grep and to parse."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        pairs = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **record_fields(record),
+        }
+        line = " ".join(f"{k}={self._quote(v)}" for k, v in pairs.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+    @staticmethod
+    def _quote(value) -> str:
+        text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+        if text and not any(ch in text for ch in ' "=\n\t'):
+            return text
+        return json.dumps(text, ensure_ascii=False)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for shipping logs to a collector."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class StaticFieldsFilter(logging.Filter):
+    """Stamps the same structured fields (e.g. `worker=2`) on every record."""
+
+    def __init__(self, fields: dict):
+        super().__init__()
+        self.fields = fields
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in self.fields.items():
+            setattr(record, name, value)
+        return True
+
+
+def configure_logging(level: str = "INFO", fmt: str = "logfmt", rate_limit_burst: int = 10, rate_limit_interval: float = 60.0,
+                      static_fields: dict = None):
+    """Installs a single stderr handler on the root logger with the chosen format and rate limiting."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if fmt == "json" else LogfmtFormatter())
+    handler.addFilter(RateLimitFilter(rate_limit_burst, rate_limit_interval))
+    if static_fields:
+        handler.addFilter(StaticFieldsFilter(static_fields))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
@@ -0,0 +1,75 @@
+import re
+
+
+class MeaninglessFilter:
+    """
+    Precompiled form of a persona's "meaningless message" rules.
+
+    A message is meaningless when it is shorter than `min_length`, consists of at most two
+    distinct characters, or when some pattern p (length n) matches and the stripped message
+    (length L) is short relative to it:
+
+        p occurs in the message (case-sensitive)   and L <= n + 2, or
+        p occurs in the message (case-insensitive) and L <  2 * n.
+
+    Both conditions only depend on L, so for every L the set of patterns that could still
+    matter is fixed. Those sets are compiled once into a single alternation regex each, which
+    replaces the per-pattern re.escape / re.search / substring loop with at most two regex
+    searches per comment.
+
+    An empty pattern marks every message meaningless (the old per-pattern loop answered True
+    for short messages and raised ZeroDivisionError for the rest, so none were ever replied to).
+    """
+
+    def __init__(self, enabled: bool = False, min_length: int = 4, patterns=()):
+        self.enabled = bool(enabled)
+        self.min_length = min_length
+
+        unique = [p for p in dict.fromkeys(patterns) if isinstance(p, str)]
+        self._match_all = "" in unique
+        unique = [p for p in unique if p]
+        self._lengths = sorted({len(p) for p in unique}) # Precomputed pattern lengths
+
+        # Stripped lengths above these bounds can't satisfy either condition
+        max_len = self._lengths[-1] if self._lengths else 0
+        self._cs_limit = max_len + 2  # L <= n + 2
+        self._ci_limit = 2 * max_len - 1  # L < 2n
+
+        compiled = {}
+
+        def compile_group(min_n: int, flags: int):
+            group = tuple(p for p in unique if len(p) >= min_n)
+            if not group: return None
+            key = (group, flags)
+            if key not in compiled:
+                alternation = "|".join(re.escape(p) for p in sorted(group, key=len, reverse=True))
+                compiled[key] = re.compile(alternation, flags)
+            return compiled[key]
+
+        # Index by stripped length L: case-sensitive patterns need n >= L - 2, case-insensitive n > L / 2
+        self._cs_by_length = [compile_group(L - 2, 0) for L in range(self._cs_limit + 1)]
+        self._ci_by_length = [compile_group(L // 2 + 1, re.IGNORECASE) for L in range(self._ci_limit + 1)]
+
+    @classmethod
+    def from_settings(cls, settings: dict):
+        return cls(
+            settings.get("filtering_enabled", False),
+            settings.get("min_message_length", 4),
+            settings.get("meaningless_patterns", []),
+        )
+
+    def __call__(self, message: str) -> bool:
+        if not self.enabled: return False
+        if len(message) < self.min_length: return True
+
+        stripped_length = len(message.strip())
+        if self._match_all: return True
+        if stripped_length <= self._cs_limit:
+            regex = self._cs_by_length[stripped_length]
+            if regex is not None and regex.search(message): return True
+        if stripped_length <= self._ci_limit:
+            regex = self._ci_by_length[stripped_length]
+            if regex is not None and regex.search(message): return True
+
+        if len(message) > 2 and len(set(message.lower())) <= 2: return True
+        return False
@@ -0,0 +1,260 @@
+import asyncio
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) for stage latency histograms: sub-millisecond matching up to multi-second LLM/TTS calls
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(pairs):
+    if not pairs: return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    if value == math.inf: return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base for a metric family; one child per combination of label values."""
+
+    type = None
+
+    def __init__(self, name: str, help_text: str, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock() # Some stages are observed from executor threads
+        self._children = {}
+        if not self.label_names:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *label_values):
+        key = tuple(str(v) for v in label_values)
+        if len(key) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class _CounterChild:
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild(self._lock)
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def samples(self):
+        for key, child in self._items():
+            yield self.name + "_total", list(zip(self.label_names, key)), child.value
+
+    def snapshot(self):
+        return {",".join(key) or "value": child.value for key, child in self._items()}
+
+
+class _HistogramChild:
+    def __init__(self, lock, buckets):
+        self._lock = lock
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot is the +Inf overflow bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q: float):
+        """Estimates the q-quantile by linear interpolation inside the bucket that contains it."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total: return None
+        rank = q * total
+        cumulative, lower = 0, 0.0
+        for upper, count in zip(self.buckets + (math.inf,), counts):
+            if count and cumulative + count >= rank:
+                if upper == math.inf: return lower # Beyond the largest bucket: report its bound
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = upper
+        return lower
+
+    def summary(self) -> dict:
+        with self._lock:
+            count, total = self.count, self.sum
+        quantiles = {f"p{int(q * 100)}": self.quantile(q) for q in (0.5, 0.95, 0.99)}
+        return {
+            "count": count,
+            "sum": round(total, 6),
+            "mean": round(total / count, 6) if count else None,
+            **{k: round(v, 6) if v is not None else None for k, v in quantiles.items()},
+        }
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, label_names)
+
+    def _new_child(self):
+        return _HistogramChild(self._lock, self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def samples(self):
+        for key, child in self._items():
+            with self._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket", labels + [("le", _format_value(upper))], cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, count
+
+    def snapshot(self):
+        return {",".join(key) or "value": child.summary() for key, child in self._items()}
+
+
+class CallbackMetric:
+    """
+    A gauge (or counter) whose value is read from `fn` at scrape time, for numbers that already
+    live elsewhere (queue depth, connected clients, cache stats). `fn` returns a number, or a
+    dict of label value -> number when `label_name` is set.
+    """
+
+    def __init__(self, name: str, help_text: str, fn, type: str = "gauge", label_name: str = None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.type = type
+        self.label_names = (label_name,) if label_name else ()
+
+    def _values(self):
+        value = self.fn()
+        if self.label_names:
+            return [((str(k),), v) for k, v in value.items()]
+        return [((), value)]
+
+    def samples(self):
+        suffix = "_total" if self.type == "counter" else ""
+        for key, value in self._values():
+            yield self.name + suffix, list(zip(self.label_names, key)), value
+
+    def snapshot(self):
+        return {",".join(key) or "value": value for key, value in self._values()}
+
+
+class MetricsRegistry:
+    def __init__(self, namespace: str = ""):
+        self.namespace = namespace
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _full_name(self, name: str) -> str:
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def counter(self, name: str, help_text: str, label_names=()) -> Counter:
+        return self._register(Counter(self._full_name(name), help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self._full_name(name), help_text, label_names, buckets))
+
+    def callback(self, name: str, help_text: str, fn, type: str = "gauge", label_name: str = None) -> CallbackMetric:
+        return self._register(CallbackMetric(self._full_name(name), help_text, fn, type, label_name))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for sample_name, labels, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """JSON-friendly view: counter/gauge values, and count/sum/mean/p50/p95/p99 per histogram."""
+        prefix = len(self.namespace) + 1 if self.namespace else 0
+        return {name[prefix:]: metric.snapshot() for name, metric in self._metrics.items()}
+
+
+async def start_metrics_server(registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9108):
+    """
+    Serves `GET /metrics` in the Prometheus text format on a bare asyncio socket, so scraping
+    needs no extra dependency. Anything else gets a 404.
+    """
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (line := await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass # Headers are not needed
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", registry.render().encode("utf-8")
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
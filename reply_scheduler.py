@@ -0,0 +1,117 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from response_cache import normalize_comment
+
+
+class ReplyScheduler:
+    """
+    Decides which comments are worth a reply and paces how fast replies go out.
+
+    - Per-user cooldown: one answered comment per viewer every `user_cooldown_seconds`.
+    - Dedup: a question whose near-duplicate normalization was already accepted within
+      `dedup_window_seconds` is dropped.
+    - Global budget: at most `replies_per_minute` LLM requests per sliding minute; workers wait
+      in `next_budgeted()` *before* taking a comment, so queued comments keep their priority
+      (and may be shed or go stale) while the budget is exhausted.
+
+    `admit()` runs at ingest time, before a comment takes up queue space; `release()` undoes it
+    for a comment that was shed or expired unanswered. Cooldowns and dedup are tracked per
+    `scope` (the backend passes the room id), while the budget is shared by all scopes.
+    """
+
+    def __init__(self, replies_per_minute: int = 20, user_cooldown_seconds: float = 20.0,
+                 dedup_window_seconds: float = 60.0, max_tracked_users: int = 10000):
+        self.replies_per_minute = replies_per_minute
+        self.user_cooldown_seconds = user_cooldown_seconds
+        self.dedup_window_seconds = dedup_window_seconds
+        self.max_tracked_users = max_tracked_users
+
+        self._user_last_admitted = OrderedDict() # user key -> monotonic time, oldest first
+        self._recent_questions = OrderedDict() # normalized text -> monotonic time, oldest first
+        self._reply_times = deque() # Monotonic times of budgeted replies in the last minute
+        self._budget_lock = asyncio.Lock() # One waiter at a time, so two can't both claim the last free slot
+
+        self.admitted = 0
+        self.rejected_cooldown = 0
+        self.rejected_duplicate = 0
+        self.released = 0
+        self.budget_waits = 0
+
+    @staticmethod
+    def _expire(ordered: OrderedDict, horizon: float):
+        while ordered and next(iter(ordered.values())) < horizon:
+            ordered.popitem(last=False)
+
+    def admit(self, user_key: str, content: str, scope=None):
+        """Returns (admitted, reason); reason is None, "cooldown" or "duplicate"."""
+        now = time.monotonic()
+        self._expire(self._user_last_admitted, now - self.user_cooldown_seconds)
+        self._expire(self._recent_questions, now - self.dedup_window_seconds)
+
+        user_key = (scope, user_key) if user_key else None
+        if user_key and user_key in self._user_last_admitted:
+            self.rejected_cooldown += 1
+            return False, "cooldown"
+        question = (scope, normalize_comment(content, near_duplicate=True))
+        if question in self._recent_questions:
+            self.rejected_duplicate += 1
+            return False, "duplicate"
+
+        if user_key and self.user_cooldown_seconds:
+            self._user_last_admitted[user_key] = now
+            while len(self._user_last_admitted) > self.max_tracked_users:
+                self._user_last_admitted.popitem(last=False)
+        if self.dedup_window_seconds:
+            self._recent_questions[question] = now
+        self.admitted += 1
+        return True, None
+
+    def release(self, user_key: str, content: str, scope=None):
+        """Lifts the cooldown and dedup entries of an admitted comment that will never be answered."""
+        if user_key:
+            self._user_last_admitted.pop((scope, user_key), None)
+        self._recent_questions.pop((scope, normalize_comment(content, near_duplicate=True)), None)
+        self.released += 1
+
+    def _trim_budget_window(self, now: float):
+        while self._reply_times and now - self._reply_times[0] >= 60.0:
+            self._reply_times.popleft()
+
+    async def _wait_for_budget(self):
+        waited = False
+        while True:
+            now = time.monotonic()
+            self._trim_budget_window(now)
+            if len(self._reply_times) < self.replies_per_minute:
+                if waited: self.budget_waits += 1
+                return
+            waited = True
+            await asyncio.sleep(60.0 - (now - self._reply_times[0]))
+
+    async def next_budgeted(self, get):
+        """
+        Waits until the replies-per-minute budget has room, then awaits `get()` for the next item
+        (e.g. `IngestQueue.get`) and spends one reply on it. Items are only taken once they can be
+        answered, so none is held outside the queue while the budget refills.
+        """
+        if not self.replies_per_minute:
+            return await get()
+        async with self._budget_lock:
+            await self._wait_for_budget()
+            item = await get() # The budget only gains room meanwhile: nothing else spends while we hold the lock
+            self._reply_times.append(time.monotonic())
+            return item
+
+    def stats(self) -> dict:
+        self._trim_budget_window(time.monotonic())
+        return {
+            "admitted": self.admitted,
+            "rejected_cooldown": self.rejected_cooldown,
+            "rejected_duplicate": self.rejected_duplicate,
+            "released": self.released,
+            "budget_waits": self.budget_waits,
+            "replies_last_minute": len(self._reply_times),
+            "replies_per_minute": self.replies_per_minute,
+        }
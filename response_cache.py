@@ -0,0 +1,177 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_REPEATED_CHAR_RE = re.compile(r"(.)\1+", re.DOTALL)
+
+
+def normalize_comment(text: str, near_duplicate: bool = False) -> str:
+    """
+    Normalizes a comment for cache lookup.
+
+    Exact mode only folds case and whitespace. Near-duplicate mode additionally applies NFKC
+    (full-width -> half-width), drops punctuation, symbols and emoji, and collapses runs of a
+    repeated character, so "包邮吗？？" / "包邮吗~~😀" / "包邮吗吗" all share one entry.
+    """
+    if near_duplicate:
+        text = unicodedata.normalize("NFKC", text)
+        text = "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PSC" or ch.isspace())
+        text = _REPEATED_CHAR_RE.sub(r"\1", text)
+    return _WHITESPACE_RE.sub(" ", text).strip().casefold()
+
+
+def prompt_fingerprint(system_prompt: str, history=()) -> str:
+    """Hash of everything besides the comment that shapes the reply: the system prompt and any conversation history."""
+    material = system_prompt if not history else json.dumps([system_prompt, list(history)], ensure_ascii=False)
+    return hashlib.sha1(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of LLM replies, keyed on (normalized comment, hash of the system prompt and history).
+
+    Values are whatever the caller stores (the backend stores `(message, mood)` tuples).
+    A persona or keyword change needs no `clear()`: it changes the system prompt, and thus the key;
+    replies under the old prompt are never hit again and age out through the TTL and LRU.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 600.0, near_duplicate: bool = False):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.near_duplicate = near_duplicate
+        self._entries = OrderedDict() # key -> (stored_at, value)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def make_key(self, comment: str, system_prompt: str, history=()):
+        return normalize_comment(comment, self.near_duplicate), prompt_fingerprint(system_prompt, history)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, value = entry
+        if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        if self._entries:
+            self._entries.clear()
+        self.invalidations += 1
+
+    def _stats_entries(self) -> int:
+        return len(self)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._stats_entries(),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 4),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+class SqliteResponseCache(ResponseCache):
+    """
+    ResponseCache stored in a SQLite file, so several backend processes (see AI_BACKEND_WORKERS)
+    share one set of replies. Same interface and semantics; LRU order is kept in a `used_at` column,
+    and ages use wall-clock time because entries outlive the process that stored them.
+
+    Values must be JSON-serializable; lists come back as tuples. Hit/miss counters are per process.
+    `get`/`put` may wait up to 5s for another process's write lock: call them off the event loop.
+    """
+
+    def __init__(self, path: str, max_entries: int = 512, ttl_seconds: float = 600.0, near_duplicate: bool = False):
+        super().__init__(max_entries, ttl_seconds, near_duplicate)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL") # Readers in other processes don't block on a writer
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, used_at REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        self._entry_count = len(self) # As of this process's last write; lets stats() skip the database
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def _db_key(key) -> str:
+        return json.dumps(key, ensure_ascii=False)
+
+    def get(self, key):
+        db_key, now = self._db_key(key), time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, stored_at FROM responses WHERE key = ?", (db_key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, stored_at = row
+            if self.ttl_seconds is not None and now - stored_at > self.ttl_seconds:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (db_key,))
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, db_key))
+            self.hits += 1
+        value = json.loads(value)
+        return tuple(value) if isinstance(value, list) else value
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, stored_at, used_at) VALUES (?, ?, ?, ?)",
+                (self._db_key(key), json.dumps(value, ensure_ascii=False), now, now),
+            )
+            count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                self._db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used_at LIMIT ?)", (excess,))
+                self.evictions += excess
+            self._entry_count = min(count, self.max_entries)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+        self._entry_count = 0
+        self.invalidations += 1
+
+    def _stats_entries(self) -> int:
+        return self._entry_count
@@ -0,0 +1,55 @@
+import asyncio
+import re
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from config_store import ConfigSnapshot
+
+DEFAULT_ROOM_ID = "default"
+_ROOM_ID_RE = re.compile(r"[\w-]{1,64}") # Room ids become config file names, so no dots or slashes
+
+
+def valid_room_id(room_id) -> bool:
+    return isinstance(room_id, str) and _ROOM_ID_RE.fullmatch(room_id) is not None
+
+
+def room_id_from_path(path: str):
+    """The `room` query parameter of a WebSocket request path (`/?room=shop_a`), or None."""
+    values = parse_qs(urlsplit(path or "").query).get("room")
+    return values[0] if values else None
+
+
+class Room:
+    """
+    One live room (one relay connection's stream): the config snapshot its replies are generated
+    with (persona + keywords), where that config lives, and the clients its replies are broadcast to.
+
+    A room without its own config file follows the default room's file until something is saved for it.
+    """
+
+    def __init__(self, room_id: str, config_path: str):
+        self.room_id = room_id
+        self.config_path = config_path
+        # Never mutated; loads, saves and patches build a new snapshot and swap this reference.
+        # Read it once per unit of work (`config = room.config`) to get a consistent view.
+        self.config = ConfigSnapshot({})
+        self.config_lock = asyncio.Lock() # Serializes read-modify-write cycles of the config and its file
+        self.config_source = None # File the live config was read from or written to
+        self.config_file_signature = None # Its signature at that time
+        self.clients = {} # websocket -> ClientSession
+        self.created_at = time.time()
+        self.last_active = time.monotonic() # Last lookup or client departure; rooms idle without clients are dropped
+
+    def idle_for(self, now: float) -> float:
+        """Seconds this room has had no clients and no lookups, or 0 while clients are connected."""
+        return 0.0 if self.clients else now - self.last_active
+
+    def stats(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "clients": len(self.clients),
+            "config_version": self.config.version,
+            "config_source": self.config_source,
+            "persona": self.config.ai_settings.get("current_persona_name"),
+            "keywords": len(self.config.keywords),
+        }
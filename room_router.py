@@ -0,0 +1,91 @@
+import asyncio
+import json
+import logging
+import zlib
+from urllib.parse import quote
+
+import websockets
+
+from room import DEFAULT_ROOM_ID, room_id_from_path, valid_room_id
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for_room(room_id: str, shards: int) -> int:
+    """Stable room -> worker assignment (crc32, unlike hash(), is the same in every process)."""
+    return zlib.crc32(room_id.encode("utf-8")) % shards
+
+
+def _control_action(frame):
+    """(action, room_id) of a client control message, or (None, None) for anything else (e.g. chat batches)."""
+    if not isinstance(frame, str) or '"action"' not in frame:
+        return None, None
+    try:
+        message = json.loads(frame)
+    except json.JSONDecodeError:
+        return None, None
+    if not isinstance(message, dict):
+        return None, None
+    return message.get("action"), message.get("room_id")
+
+
+async def _connect_worker(url: str, timeout: float):
+    """Connects to a worker, retrying while it is (re)starting."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        try:
+            return await websockets.connect(url, max_size=None)
+        except OSError:
+            if asyncio.get_running_loop().time() >= deadline: raise
+            await asyncio.sleep(0.25)
+
+
+async def _pipe_to_client(upstream, client):
+    try:
+        async for frame in upstream:
+            await client.send(frame)
+    except websockets.exceptions.ConnectionClosed:
+        return
+    # The worker ended the connection (e.g. evicted a slow consumer): pass its close code on
+    await client.close(upstream.close_code or 1011, upstream.close_reason or "")
+
+
+async def proxy_connection(client, worker_urls, connect_timeout: float = 10.0):
+    """
+    Front-process half of worker mode: pipes one client connection to the worker that owns its room,
+    and moves it to another worker when a `join_room` switches to a room owned elsewhere. The last
+    `set_protocol` is replayed on the new worker so the client keeps its negotiated format.
+    """
+    room_id = room_id_from_path(client.request.path) or DEFAULT_ROOM_ID
+    if not valid_room_id(room_id):
+        room_id = DEFAULT_ROOM_ID
+    protocol_frame = None
+    handover_frame = None # The join_room that triggered a move, delivered to the new worker
+    while True:
+        shard = shard_for_room(room_id, len(worker_urls))
+        url = f"{worker_urls[shard]}/?room={quote(room_id)}"
+        moved_to = None
+        async with await _connect_worker(url, connect_timeout) as upstream:
+            for frame in (protocol_frame, handover_frame):
+                if frame is not None: await upstream.send(frame)
+            downstream = asyncio.create_task(_pipe_to_client(upstream, client))
+            try:
+                async for frame in client:
+                    action, target = _control_action(frame)
+                    if action == "set_protocol":
+                        protocol_frame = frame
+                    elif action == "join_room" and valid_room_id(target):
+                        if shard_for_room(target, len(worker_urls)) != shard:
+                            moved_to, handover_frame = target, frame
+                            break
+                        room_id = target
+                    await upstream.send(frame)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            finally:
+                downstream.cancel()
+                await asyncio.gather(downstream, return_exceptions=True)
+        if moved_to is None:
+            return
+        logger.info("Client %s moved to room %s on worker %d.", client.remote_address, moved_to, shard_for_room(moved_to, len(worker_urls)))
+        room_id = moved_to
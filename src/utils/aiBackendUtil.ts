@@ -0,0 +1,48 @@
+/**
+ * AI 后端地址
+ */
+export const AI_BACKEND_URL = 'ws://localhost:8080';
+
+/**
+ * 未指定房间时后端使用的房间
+ */
+export const DEFAULT_AI_ROOM_ID = 'default';
+
+/**
+ * 验证 AI 后端房间 ID（字母、数字、_、-，最长 64 个字符，与后端一致）
+ * @param value
+ * @returns
+ */
+export function verifyAiRoomId(value: string) {
+  const reg = /^[\w-]{1,64}$/;
+  return reg.test(value);
+}
+
+/**
+ * 页面地址中的房间 ID：`#/ai?room=shop_a` 或 `?room=shop_a#/ai`，没有则为默认房间
+ * @returns
+ */
+export function getAiRoomIdFromLocation() {
+  const hashQuery = window.location.hash.split('?')[1] || '';
+  const roomId = new URLSearchParams(hashQuery).get('room') || new URLSearchParams(window.location.search).get('room');
+  return roomId && verifyAiRoomId(roomId) ? roomId : DEFAULT_AI_ROOM_ID;
+}
+
+/**
+ * 把房间 ID 写回页面地址（不触发路由切换），刷新页面后仍连接同一房间
+ * @param roomId
+ */
+export function setAiRoomIdInLocation(roomId: string) {
+  const path = window.location.hash.slice(1).split('?')[0] || '/';
+  const hash = roomId === DEFAULT_AI_ROOM_ID ? path : `${path}?room=${encodeURIComponent(roomId)}`;
+  window.history.replaceState(null, '', `${window.location.pathname}${window.location.search}#${hash}`);
+}
+
+/**
+ * 连接指定房间的 AI 后端地址
+ * @param roomId
+ * @returns
+ */
+export function buildAiBackendUrl(roomId: string) {
+  return `${AI_BACKEND_URL}/?room=${encodeURIComponent(roomId)}`;
+}
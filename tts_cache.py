@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def tts_cache_key(text: str, voice: str, language: str, model: str) -> str:
+    """Content address of a synthesized clip: everything that changes the audio goes into the hash."""
+    payload = json.dumps([text, voice, language, model], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSAudioCache:
+    """
+    Content-addressed on-disk cache of synthesized WAV clips.
+
+    Each entry is `<key>.wav` plus a `<key>.json` sidecar holding the sampling rate, so cached
+    audio never needs its WAV header parsed again. Total size is capped; the least recently
+    used clips (tracked in memory, seeded from file mtimes at startup) are evicted first.
+    Methods are thread-safe, since synthesis runs on executor threads. Several processes may share
+    one directory: entries another process wrote are adopted on first lookup.
+    """
+
+    def __init__(self, directory: str = "tts_cache", max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = OrderedDict() # key -> size in bytes, least recently used first
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key)
+        return base + ".wav", base + ".json"
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".wav"): continue
+            key = name[:-4]
+            wav_path, meta_path = self._paths(key)
+            if not os.path.exists(meta_path): continue
+            stat = os.stat(wav_path)
+            entries.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+        self._evict_over_cap()
+
+    def _adopt(self, key: str) -> bool:
+        """Indexes an entry that another process stored since our index was built. Caller holds the lock."""
+        wav_path, meta_path = self._paths(key)
+        if not os.path.exists(meta_path): return False
+        try:
+            size = os.path.getsize(wav_path)
+        except OSError:
+            return False
+        self._index[key] = size
+        self._total_bytes += size
+        return True
+
+    def __contains__(self, key: str):
+        with self._lock:
+            return key in self._index or self._adopt(key)
+
+    def get(self, key: str):
+        """Returns (wav_bytes, sampling_rate) for a cached clip, or None."""
+        with self._lock:
+            if key not in self._index and not self._adopt(key):
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+        wav_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                sampling_rate = json.load(f)["sampling_rate"]
+            with open(wav_path, "rb") as f:
+                wav_bytes = f.read()
+            os.utime(wav_path) # Persist recency for the next startup's LRU order
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Dropping unreadable entry %s: %s", key, e)
+            self._discard(key)
+            with self._lock: self.misses += 1
+            return None
+        with self._lock: self.hits += 1
+        return wav_bytes, sampling_rate
+
+    def put(self, key: str, wav_bytes: bytes, sampling_rate: int, text: str = None):
+        wav_path, meta_path = self._paths(key)
+        meta = json.dumps({"sampling_rate": sampling_rate, "text": text}, ensure_ascii=False).encode("utf-8")
+        try:
+            # The WAV goes first: an entry only counts once its sidecar exists
+            self._atomic_write(wav_path, wav_bytes)
+            self._atomic_write(meta_path, meta)
+        except OSError as e:
+            logger.warning("Could not store entry %s: %s", key, e)
+            return
+        with self._lock:
+            self._total_bytes += len(wav_bytes) - self._index.pop(key, 0)
+            self._index[key] = len(wav_bytes)
+            self._evict_over_cap()
+
+    @staticmethod
+    def _atomic_write(path: str, data: bytes):
+        # Write to a temp file then rename, so a concurrent reader never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict_over_cap(self):
+        # Caller holds the lock (or is __init__)
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            for path in self._paths(key):
+                try: os.remove(path)
+                except OSError: pass
+
+    def _discard(self, key: str):
+        with self._lock:
+            self._total_bytes -= self._index.pop(key, 0)
+        for path in self._paths(key):
+            try: os.remove(path)
+            except OSError: pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }